@@ -0,0 +1,418 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Find the packages that are bundled more than once across the core bundle and
+the federated extensions.
+
+A package that an extension bundles is only deduplicated at runtime if the
+extension shares it and the version the core provides satisfies the version
+the extension requires.  Otherwise the extension loads its own copy, which
+costs bytes and parse time.
+
+The modules of each bundle are read from a webpack `stats.json` in its output
+directory when there is one, or else from the module headers of its emitted
+development-mode chunks.  The shared config of each bundle is read from its
+`build_log.json`, or else derived from its package data the way the builds
+do.
+
+e.g. python analyze.py
+     python analyze.py --json report.json
+"""
+import argparse
+import glob
+import json
+import os
+import os.path as osp
+import re
+import sys
+
+from build import get_output_dir, get_package_data, get_packages
+
+# The module headers of development-mode webpack chunks.
+MODULE_HEADER_RE = re.compile(r'^/\*\*\*/ "([^"]+)":', re.MULTILINE)
+
+# The chunks of a bundle.
+CHUNK_PATTERNS = ('*.js', 'static/*.js')
+
+
+def get_module_package(module_name):
+    """Get the npm package a module path belongs to, or None for the
+    bundle's own modules."""
+    index = module_name.rfind('node_modules/')
+    if index == -1:
+        return None
+    parts = module_name[index + len('node_modules/'):].split('/')
+    if parts[0].startswith('@') and len(parts) > 1:
+        return '/'.join(parts[:2])
+    return parts[0]
+
+
+def _iter_stats_modules(modules):
+    for module in modules:
+        if module.get('modules'):
+            # A concatenated module.
+            for child in _iter_stats_modules(module['modules']):
+                yield child
+        elif module.get('name'):
+            yield module['name'], module.get('size', 0)
+
+
+def get_bundled_packages(output_dir):
+    """Get the size in bytes of each npm package bundled in an output
+    directory.
+
+    Returns
+    -------
+    A (sizes, source) tuple, where source is 'stats', 'chunks' or None if
+    the modules could not be read.
+    """
+    sizes = dict()
+    stats_path = osp.join(output_dir, 'stats.json')
+    if osp.exists(stats_path):
+        with open(stats_path) as fid:
+            stats = json.load(fid)
+        for (name, size) in _iter_stats_modules(stats.get('modules', [])):
+            package = get_module_package(name)
+            if package:
+                sizes[package] = sizes.get(package, 0) + size
+        return sizes, 'stats'
+
+    found = False
+    for pattern in CHUNK_PATTERNS:
+        for path in sorted(glob.glob(osp.join(output_dir, pattern))):
+            with open(path, encoding='utf-8', errors='replace') as fid:
+                source = fid.read()
+            matches = list(MODULE_HEADER_RE.finditer(source))
+            found = found or bool(matches)
+            for (i, match) in enumerate(matches):
+                end = matches[i + 1].start() if i + 1 < len(matches) else len(source)
+                package = get_module_package(match.group(1))
+                if package:
+                    size = len(source[match.start():end].encode('utf-8'))
+                    sizes[package] = sizes.get(package, 0) + size
+    return sizes, 'chunks' if found else None
+
+
+def _normalize_shared(shared):
+    """Normalize a ModuleFederationPlugin `shared` option to a dict of
+    package name to options."""
+    if isinstance(shared, list):
+        shared = dict((name, {}) for name in shared)
+    normalized = dict()
+    for (name, value) in shared.items():
+        if isinstance(value, str):
+            value = dict(requiredVersion=value)
+        normalized[name] = dict(value)
+    return normalized
+
+
+def _read_build_log_shared(output_dir):
+    path = osp.join(output_dir, 'build_log.json')
+    if not osp.exists(path):
+        return None
+    with open(path) as fid:
+        configs = json.load(fid)
+    for config in configs if isinstance(configs, list) else [configs]:
+        for plugin in config.get('plugins', []):
+            options = plugin.get('_options') if isinstance(plugin, dict) else None
+            if options and 'shared' in options:
+                return _normalize_shared(options['shared'])
+    return None
+
+
+def get_core_shared(core_path):
+    """Get the shared config of the core bundle.
+
+    This mirrors `core_package/webpack.config.js`, which shares every
+    resolution and marks the `singletonPackages` as singletons.
+    """
+    shared = _read_build_log_shared(get_output_dir(core_path))
+    if shared is not None:
+        return shared
+    data = get_package_data(core_path)
+    shared = _normalize_shared(data.get('resolutions', {}))
+    for name in data['jupyterlab'].get('singletonPackages', []):
+        shared[name] = dict(singleton=True)
+    return shared
+
+
+def get_extension_shared(package_path):
+    """Get the shared config of an extension bundle.
+
+    This mirrors `jupyter labextension build`, which shares the
+    dependencies of the extension with their required version, and marks
+    its `singletonPackages` as singletons.
+    """
+    shared = _read_build_log_shared(get_output_dir(package_path))
+    if shared is not None:
+        return shared
+    data = get_package_data(package_path)
+    shared = _normalize_shared(data.get('dependencies', {}))
+    for name in data['jupyterlab'].get('singletonPackages', []):
+        shared.setdefault(name, dict())['singleton'] = True
+    return shared
+
+
+def get_provided_versions(core_path):
+    """Get the version of each package the core provides to the share scope,
+    from its installed packages or else its resolutions."""
+    data = get_package_data(core_path)
+    versions = dict()
+    for (name, spec) in data.get('resolutions', {}).items():
+        package_json = osp.join(core_path, 'node_modules', name, 'package.json')
+        if osp.exists(package_json):
+            with open(package_json) as fid:
+                versions[name] = json.load(fid)['version']
+        else:
+            versions[name] = spec.lstrip('^~=v ')
+    return versions
+
+
+# ---------------------------------------------------------------------------
+# Version ranges
+# ---------------------------------------------------------------------------
+
+VERSION_RE = re.compile(
+    r'^v?(\d+|[xX*])(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?(?:-([0-9A-Za-z.-]+))?'
+)
+
+
+def parse_version(version):
+    """Parse a version into a comparable tuple, or None if invalid."""
+    match = VERSION_RE.match(version.strip())
+    if not match or not all(p and p.isdigit() for p in match.groups()[:3]):
+        return None
+    major, minor, patch, pre = match.groups()
+    if pre is None:
+        # A release sorts after all of its prereleases.
+        pre_key = (1,)
+    else:
+        pre_key = (0,) + tuple(
+            (0, int(p), '') if p.isdigit() else (1, 0, p)
+            for p in pre.split('.')
+        )
+    return (int(major), int(minor), int(patch), pre_key)
+
+
+def _comparator_bounds(comparator):
+    """Get the (lower, upper) bounds of a comparator as
+    ((version, inclusive), (version, inclusive)) with None for unbounded."""
+    match = re.match(r'^(\^|~|>=|<=|>|<|=)?\s*(.*)$', comparator)
+    op, version = match.groups()
+    match = VERSION_RE.match(version)
+    if not match or match.group(1) in 'xX*':
+        return None, None
+    parts = [p if p is not None and p.isdigit() else None
+             for p in match.groups()[:3]]
+    pre = match.group(4)
+    major = int(parts[0])
+    minor = int(parts[1]) if parts[1] is not None else None
+    patch = int(parts[2]) if parts[2] is not None else None
+    base = '%s.%s.%s' % (major, minor or 0, patch or 0)
+    if pre:
+        base += '-' + pre
+    lower = (parse_version(base), True)
+
+    if op in ('>', '>='):
+        return (parse_version(base), op == '>='), None
+    if op in ('<', '<='):
+        return None, (parse_version(base), op == '<=')
+
+    def bump(major, minor=0, patch=0):
+        return parse_version('%s.%s.%s-0' % (major, minor, patch)), False
+
+    if minor is None:
+        return lower, bump(major + 1)
+    if patch is None:
+        return lower, bump(major, minor + 1)
+    if op == '^':
+        if major:
+            return lower, bump(major + 1)
+        if minor:
+            return lower, bump(0, minor + 1)
+        return lower, bump(0, 0, patch + 1)
+    if op == '~':
+        return lower, bump(major, minor + 1)
+    return lower, (parse_version(base), True)
+
+
+def satisfies(version, spec):
+    """Test whether a version satisfies an npm version range."""
+    parsed = parse_version(version)
+    if parsed is None:
+        return False
+    for alternative in spec.split('||'):
+        comparators = re.findall(r'(?:\^|~|>=|<=|>|<|=)?\s*[^\s]+',
+                                 alternative.strip())
+        ok = True
+        for comparator in comparators:
+            lower, upper = _comparator_bounds(comparator.strip())
+            if lower and (parsed < lower[0] or
+                          (parsed == lower[0] and not lower[1])):
+                ok = False
+            if upper and (parsed > upper[0] or
+                          (parsed == upper[0] and not upper[1])):
+                ok = False
+        if ok:
+            return True
+    return False
+
+
+# ---------------------------------------------------------------------------
+# Analysis
+# ---------------------------------------------------------------------------
+
+def analyze(packages, core_name=None):
+    """Analyze the shared module duplication across bundles.
+
+    Parameters
+    ----------
+    packages: dict
+        A mapping of package name to package path, including the core.
+    core_name: str, optional
+        The name of the core package, defaults to the package with a
+        `buildDir`.
+
+    Returns
+    -------
+    A dict with the `bundles` that were read, the `duplicates` (package
+    name -> bundles, loaded copies and wasted bytes) and the version
+    `mismatches`.
+    """
+    if core_name is None:
+        core_name = next(
+            name for (name, path) in packages.items()
+            if 'buildDir' in get_package_data(path)['jupyterlab']
+        )
+    core_path = packages[core_name]
+    core_shared = get_core_shared(core_path)
+    provided = get_provided_versions(core_path)
+
+    bundles = dict()
+    mismatches = []
+    # Package -> list of (bundle, size, status).
+    copies = dict()
+    for (name, path) in packages.items():
+        is_core = name == core_name
+        sizes, source = get_bundled_packages(get_output_dir(path))
+        bundles[name] = dict(source=source, packages=len(sizes))
+        shared = core_shared if is_core else get_extension_shared(path)
+        for (package, size) in sizes.items():
+            options = shared.get(package)
+            if is_core:
+                status = 'provided' if options is not None else 'bundled'
+            elif options is None:
+                status = 'not shared'
+            elif package not in core_shared:
+                status = 'not provided by core'
+            elif options.get('import') is False:
+                status = 'shared'
+            else:
+                required = options.get('requiredVersion')
+                version = provided.get(package)
+                if required and version and not satisfies(version, required):
+                    status = 'version mismatch'
+                    mismatches.append(dict(
+                        bundle=name, package=package, required=required,
+                        provided=version,
+                        singleton=bool(options.get('singleton') or
+                                       core_shared[package].get('singleton'))
+                    ))
+                else:
+                    # The bundled copy is only a fallback that is not loaded.
+                    status = 'shared'
+            copies.setdefault(package, []).append(dict(
+                bundle=name, size=size, status=status))
+
+    duplicates = dict()
+    for (package, items) in copies.items():
+        loaded = [item for item in items if item['status'] != 'shared']
+        if len(loaded) < 2:
+            continue
+        sizes = sorted(item['size'] for item in loaded)
+        core_sizes = [item['size'] for item in loaded
+                      if item['bundle'] == core_name]
+        if core_sizes:
+            # The core copy is always loaded, so every other copy is waste.
+            wasted = sum(sizes) - core_sizes[0]
+        else:
+            wasted = sum(sizes[:-1])
+        duplicates[package] = dict(
+            copies=items,
+            loaded=len(loaded),
+            wasted_bytes=wasted
+        )
+    return dict(
+        core=core_name,
+        bundles=bundles,
+        duplicates=duplicates,
+        mismatches=mismatches,
+        wasted_bytes=sum(d['wasted_bytes'] for d in duplicates.values())
+    )
+
+
+def _format_size(size):
+    if size >= 1024 * 1024:
+        return '%.1f MB' % (size / 1024.0 / 1024.0)
+    if size >= 1024:
+        return '%.1f KB' % (size / 1024.0)
+    return '%d B' % size
+
+
+def print_report(report):
+    """Print a duplication report."""
+    for (name, bundle) in sorted(report['bundles'].items()):
+        if bundle['source'] is None:
+            print('warning: could not read the modules of %s, build it in '
+                  'development mode or write a stats.json' % name)
+
+    duplicates = sorted(report['duplicates'].items(),
+                        key=lambda item: -item[1]['wasted_bytes'])
+    print('Packages loaded more than once:')
+    if not duplicates:
+        print('  none')
+    for (package, data) in duplicates:
+        print('  %s: %s copies, %s wasted' % (
+            package, data['loaded'], _format_size(data['wasted_bytes'])))
+        for item in data['copies']:
+            print('    %-50s %10s  %s' % (
+                item['bundle'], _format_size(item['size']), item['status']))
+
+    print('')
+    print('Version mismatches that prevent sharing:')
+    if not report['mismatches']:
+        print('  none')
+    for item in report['mismatches']:
+        print('  %s requires %s@%s, the core provides %s%s' % (
+            item['bundle'], item['package'], item['required'],
+            item['provided'],
+            ' (singleton)' if item['singleton'] else ''
+        ))
+
+    print('')
+    print('Total wasted: %s' % _format_size(report['wasted_bytes']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--json', metavar='PATH',
+        help='also write the report as JSON to a file'
+    )
+    args = parser.parse_args(argv)
+
+    report = analyze(get_packages())
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as fid:
+            json.dump(report, fid, indent=2, sort_keys=True)
+            fid.write('\n')
+    # Fail when a singleton cannot be shared, as the app will misbehave.
+    if any(item['singleton'] for item in report['mismatches']):
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
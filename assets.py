@@ -0,0 +1,371 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Static asset handlers for the core bundle and the federated lab extensions.
+"""
+from collections import OrderedDict
+import logging
+import mimetypes
+import os
+
+from jupyter_server.utils import filefind
+from jupyterlab_server.server import FileFindHandler
+
+from discovery import REMOTE_ENTRY, stat_signature
+
+# The precompressed siblings written by `build.py compress`, in order of
+# preference.
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+
+def accepted_encodings(header):
+    """Parse an Accept-Encoding header into the set of accepted encodings."""
+    encodings = set()
+    for item in (header or '').split(','):
+        parts = item.strip().split(';')
+        encoding = parts[0].strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            encodings.add(encoding)
+    return encodings
+
+
+class FileIndex(object):
+    """An index of the files in a search path, mapping each relative path to
+    the file served for it.
+
+    A file in an earlier directory shadows the same relative path in later
+    ones.  `refresh` only lists the directories whose stat signature
+    changed, and is meant to be called periodically off the event loop.
+
+    Parameters
+    ----------
+    roots: list of str
+        The directories to search, in order of precedence.
+    log: logging.Logger, optional
+        The logger to use.
+    """
+
+    def __init__(self, roots, log=None):
+        self.roots = [os.path.abspath(os.path.expanduser(r)) for r in roots]
+        self.log = log or logging.getLogger(__name__)
+        # Root -> (list of (directory, signature), relative path -> file).
+        self._listings = {}
+        self._files = {}
+        self._paths = frozenset()
+        self.refresh()
+
+    def resolve(self, path):
+        """Get the absolute path of the file served for a relative path, or
+        None if there is none."""
+        return self._files.get(os.path.normpath(path))
+
+    def contains(self, abspath):
+        """Whether a file exists in any of the directories."""
+        return abspath in self._paths
+
+    def refresh(self):
+        """Revalidate the index against the filesystem.
+
+        Returns
+        -------
+        Whether any of the directories changed.
+        """
+        listings = dict()
+        files = dict()
+        for root in self.roots:
+            listings[root] = self._list_root(root)
+            for (path, abspath) in listings[root][1].items():
+                files.setdefault(path, abspath)
+        changed = any(listings[r] is not self._listings.get(r)
+                      for r in self.roots)
+        self._listings = listings
+        if changed:
+            # Swap in the new maps whole, for lookups on the event loop.
+            self._paths = frozenset(
+                abspath for (_, root_files) in listings.values()
+                for abspath in root_files.values()
+            )
+            self._files = files
+        return changed
+
+    def _list_root(self, root):
+        """List the files under a directory, reusing the cached listing when
+        none of its directories changed.
+        """
+        cached = self._listings.get(root)
+        if cached and all(stat_signature(d) == sig for (d, sig) in cached[0]):
+            return cached
+
+        dirs = []
+        files = dict()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            sig = stat_signature(path)
+            if sig is None:
+                if path == root:
+                    # A missing root is recorded too, so that creating it
+                    # invalidates the listing.
+                    dirs.append((path, None))
+                continue
+            dirs.append((path, sig))
+            try:
+                entries = list(os.scandir(path))
+            except OSError as e:
+                self.log.warning('Could not list %s: %s', path, e)
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    files[os.path.relpath(entry.path, root)] = entry.path
+        return (dirs, files)
+
+
+class PrecompressedMixin(object):
+    """Serve the best precompressed sibling of a file that the client
+    accepts, so no compression happens at request time.
+
+    Siblings older than the original file are ignored.
+    """
+
+    content_encoding = None
+    compressed_path = None
+    original_path = None
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super().validate_absolute_path(root, absolute_path)
+        if absolute_path is None:
+            return None
+        self.original_path = absolute_path
+        accepted = accepted_encodings(
+            self.request.headers.get('Accept-Encoding'))
+        source_mtime = None
+        for (encoding, suffix) in PRECOMPRESSED:
+            if not self.may_exist(absolute_path + suffix):
+                continue
+            try:
+                st = os.stat(absolute_path + suffix)
+            except OSError:
+                continue
+            if source_mtime is None:
+                source_mtime = os.stat(absolute_path).st_mtime
+            if st.st_mtime < source_mtime:
+                continue
+            # The response depends on the header once a sibling exists.
+            self.set_header('Vary', 'Accept-Encoding')
+            if encoding in accepted and self.content_encoding is None:
+                self.content_encoding = encoding
+                self.compressed_path = absolute_path + suffix
+                compressed_stat = st
+        if self.content_encoding is not None:
+            # Describe the sibling rather than the validated original.
+            self._stat_result = compressed_stat
+            return self.compressed_path
+        return absolute_path
+
+    def may_exist(self, path):
+        """Whether a sibling may exist, to skip stating the ones that do
+        not."""
+        return True
+
+    def get_content_type(self):
+        if self.content_encoding is None:
+            return super().get_content_type()
+        mime_type, _ = mimetypes.guess_type(self.original_path)
+        return mime_type or 'application/octet-stream'
+
+    def set_extra_headers(self, path):
+        super().set_extra_headers(path)
+        if self.content_encoding is not None:
+            self.set_header('Content-Encoding', self.content_encoding)
+
+
+class AssetCache(object):
+    """A bounded LRU cache of the contents of asset files.
+
+    Entries are keyed by absolute path and invalidated when the stat
+    signature of the file changes.  The files are read whole rather than
+    memory-mapped, since the builds rewrite them in place, which would fault
+    a mapping that is being served.
+
+    Parameters
+    ----------
+    max_bytes: int, optional
+        The total size of the cached files.  Larger files are not cached.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        # Path -> (signature, data).
+        self._entries = OrderedDict()
+
+    def get(self, path, stat_result):
+        """Get the contents of a file.
+
+        Parameters
+        ----------
+        path: str
+            The absolute path of the file.
+        stat_result: os.stat_result
+            The current stat of the file.
+
+        Returns
+        -------
+        The contents, or None if the file is too large to cache or changed
+        while it was read.
+        """
+        sig = (stat_result.st_mtime_ns, stat_result.st_size,
+               stat_result.st_ino)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == sig:
+            self.hits += 1
+            self._entries.move_to_end(path)
+            return entry[1]
+
+        self.misses += 1
+        if entry is not None:
+            self._remove(path)
+        size = stat_result.st_size
+        if size > self.max_bytes:
+            return None
+        try:
+            with open(path, 'rb') as fid:
+                data = fid.read()
+        except OSError:
+            return None
+        if len(data) != size:
+            return None
+
+        self._entries[path] = (sig, data)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        return data
+
+    def _remove(self, path):
+        _, data = self._entries.pop(path)
+        self.size -= len(data)
+
+    def clear(self):
+        """Drop every entry."""
+        self._entries.clear()
+        self.size = 0
+
+
+class IndexedFilesMixin(object):
+    """Resolve the requested files through a `FileIndex` instead of
+    searching the directories on every request.
+
+    Unlike the method it overrides, `get_absolute_path` cannot be called on
+    the class, and the results are not shared between handlers.  A path
+    that is not in the index is searched for, in case the file was added
+    since the index was last refreshed.
+    """
+
+    file_index = None
+
+    def initialize(self, path, file_index=None, **kwargs):
+        super().initialize(path, **kwargs)
+        self.file_index = file_index
+
+    def get_absolute_path(self, roots, path):
+        if self.file_index is None:
+            return super().get_absolute_path(roots, path)
+        abspath = self.file_index.resolve(path)
+        if abspath is not None:
+            return abspath
+        # A file added since the last refresh is searched for, though not
+        # through the upstream results cache, which is shared between the
+        # handlers and never invalidated.
+        try:
+            return os.path.abspath(filefind(path, roots))
+        except OSError:
+            return ''
+
+    def may_exist(self, path):
+        return self.file_index is None or self.file_index.contains(path)
+
+
+class CachedContentMixin(object):
+    """Serve file contents from the `AssetCache` in the `asset_cache`
+    setting of the web application, if any.
+
+    Unlike the method it overrides, `get_content` cannot be called on the
+    class, which is fine since these handlers do not compute content hashes.
+    """
+
+    def get_content(self, abspath, start=None, end=None):
+        cache = self.settings.get('asset_cache')
+        if cache is None:
+            return super().get_content(abspath, start, end)
+        hits = cache.hits
+        data = cache.get(abspath, self._stat())
+        lab_metrics = self.settings.get('lab_metrics')
+        if lab_metrics is not None:
+            lab_metrics.asset_cache_total.inc(
+                result='hit' if cache.hits > hits else 'miss')
+        if data is None:
+            return super().get_content(abspath, start, end)
+        start = start or 0
+        end = len(data) if end is None else end
+        return data if (start, end) == (0, len(data)) else data[start:end]
+
+
+class StaticAssetHandler(CachedContentMixin, IndexedFilesMixin,
+                         PrecompressedMixin, FileFindHandler):
+    """Serve the core bundle and its static assets."""
+
+
+class LabExtensionHandler(CachedContentMixin, IndexedFilesMixin,
+                          PrecompressedMixin, FileFindHandler):
+    """Serve the assets of the federated lab extensions.
+
+    A remote entry requested with the `v` query parameter matching its
+    current content hash is served as immutable, so that reloads do not
+    need to revalidate it.  Everything else must be revalidated.
+    """
+
+    def initialize(self, path, index, file_index=None, default_filename=None,
+                   no_cache_paths=None):
+        super().initialize(path, file_index=file_index,
+                           default_filename=default_filename,
+                           no_cache_paths=no_cache_paths)
+        self.index = index
+
+    def is_immutable(self):
+        """Whether the request is for the current version of a remote entry."""
+        version = self.get_argument('v', None)
+        if not version:
+            return False
+        if any(self.request.path.startswith(p) for p in self.no_cache_paths):
+            return False
+        name, _, fname = self.path.rpartition('/')
+        ext = self.index.extensions.get(name)
+        return (fname == REMOTE_ENTRY and ext is not None and
+                ext.get('remote_entry_hash') == version)
+
+    def get_cache_time(self, path, modified, mime_type):
+        return self.CACHE_MAX_AGE if self.is_immutable() else 0
+
+    def set_headers(self):
+        super().set_headers()
+        if self.is_immutable():
+            self.set_header('Cache-Control', 'public, max-age=%d, immutable'
+                            % self.CACHE_MAX_AGE)
+        else:
+            self.set_header('Cache-Control', 'no-cache')
@@ -0,0 +1,430 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Build tools for the core bundle and the federated extension packages.
+
+e.g. python build.py packages --jobs 4
+     python build.py manifest
+     python build.py themes
+     python build.py compress
+"""
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import gzip
+import io
+import json
+import os
+import os.path as osp
+import subprocess
+import sys
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HERE = osp.abspath(osp.dirname(__file__))
+
+# Asset types worth compressing.  Images and fonts other than svg and ttf are
+# already compressed.
+COMPRESSIBLE_EXTENSIONS = (
+    '.css', '.eot', '.html', '.js', '.json', '.map', '.otf', '.svg',
+    '.ttf', '.txt'
+)
+
+# Files smaller than this are not worth an extra request header.
+MIN_COMPRESS_SIZE = 1024
+
+# The encodings written next to each asset, keyed by file suffix.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def get_packages(root=HERE):
+    """Get the paths of the packages in the repository that have
+    `jupyterlab` metadata, keyed by package name.
+    """
+    packages = {}
+    for name in sorted(os.listdir(root)):
+        package_json = osp.join(root, name, 'package.json')
+        if not osp.exists(package_json):
+            continue
+        with open(package_json) as fid:
+            data = json.load(fid)
+        if 'jupyterlab' in data:
+            packages[data['name']] = osp.join(root, name)
+    return packages
+
+
+def get_package_data(package_path):
+    """Read the package.json of a package."""
+    with open(osp.join(package_path, 'package.json')) as fid:
+        return json.load(fid)
+
+
+def get_output_dir(package_path):
+    """Get the static asset directory of a package."""
+    with open(osp.join(package_path, 'package.json')) as fid:
+        data = json.load(fid)
+    output_dir = data['jupyterlab'].get('outputDir', 'static')
+    return osp.normpath(osp.join(package_path, output_dir))
+
+
+def get_build_graph(packages):
+    """Get the local packages each package must be built after.
+
+    A package depends on the local packages it lists in its dependencies or
+    in its `jupyterlab` `singletonPackages`, like the federated markdown
+    package does with the middle package.
+
+    Parameters
+    ----------
+    packages: dict
+        A mapping of package name to package path.
+
+    Returns
+    -------
+    A dict mapping each package name to the set of names it depends on.
+    """
+    graph = dict()
+    for (name, path) in packages.items():
+        data = get_package_data(path)
+        deps = set(data.get('dependencies', {}))
+        deps.update(data.get('devDependencies', {}))
+        deps.update(data['jupyterlab'].get('singletonPackages', []))
+        graph[name] = set(d for d in deps if d in packages and d != name)
+
+    # Fail early on cycles, which would never be scheduled.
+    visiting = set()
+    done = set()
+
+    def visit(name, chain):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError('Dependency cycle: %s' % ' -> '.join(chain))
+        visiting.add(name)
+        for dep in sorted(graph[name]):
+            visit(dep, chain + [dep])
+        visiting.remove(name)
+        done.add(name)
+
+    for name in sorted(graph):
+        visit(name, [name])
+    return graph
+
+
+def get_build_commands(package_path, prod=False):
+    """Get the commands that build a package.
+
+    The core package is built with its own webpack config, and the
+    federated extensions with `jupyter labextension build`, after their
+    TypeScript sources if they have a `build:lib` script.
+    """
+    data = get_package_data(package_path)
+    scripts = data.get('scripts', {})
+    if 'buildDir' in data['jupyterlab']:
+        return [['jlpm', 'run', 'build:prod' if prod else 'build']]
+    commands = []
+    if 'build:lib' in scripts:
+        commands.append(['jlpm', 'run', 'build:lib'])
+    command = ['jupyter', 'labextension', 'build']
+    if prod:
+        command.append('--prod')
+    commands.append(command + ['.'])
+    return commands
+
+
+def _run_job(path, commands, log_path):
+    """Run the commands of a build job, logging their output to a file.
+
+    Returns
+    -------
+    A (returncode, duration) tuple.
+    """
+    start = time.time()
+    with open(log_path, 'w') as log:
+        for command in commands:
+            log.write('$ %s\n' % ' '.join(command))
+            log.flush()
+            try:
+                returncode = subprocess.call(
+                    command, cwd=path, stdout=log, stderr=subprocess.STDOUT)
+            except OSError as e:
+                log.write('%s\n' % e)
+                returncode = 127
+            if returncode:
+                return returncode, time.time() - start
+    return 0, time.time() - start
+
+
+def build_packages(packages, jobs=None, prod=False, log_dir=None):
+    """Build packages in parallel, each one after the packages it depends on.
+
+    The jobs are run as subprocesses from a pool of `jobs` workers.  A job
+    whose dependency failed is skipped.
+
+    Parameters
+    ----------
+    packages: dict
+        A mapping of package name to package path.
+    jobs: int, optional
+        The number of jobs to run at once, defaults to the number of CPUs.
+    prod: bool, optional
+        Whether to make production builds.
+    log_dir: str, optional
+        The directory for the output of each job.
+
+    Returns
+    -------
+    A dict mapping each package name to a dict with its `status` (one of
+    'ok', 'failed' or 'skipped'), `duration` in seconds and `log` path.
+    """
+    graph = get_build_graph(packages)
+    log_dir = log_dir or osp.join(HERE, 'build', 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    results = dict()
+    pending = dict((name, set(deps)) for (name, deps) in graph.items())
+    running = dict()
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        while pending or running:
+            for name in sorted(pending):
+                deps = pending[name]
+                failed = [d for d in deps
+                          if results.get(d, {}).get('status') in
+                          ('failed', 'skipped')]
+                if failed:
+                    del pending[name]
+                    results[name] = dict(status='skipped', duration=0,
+                                         log=None, blocked_by=failed)
+                    print('[skipped] %s (%s failed)' % (name, ', '.join(failed)))
+                elif all(d in results for d in deps):
+                    del pending[name]
+                    log_path = osp.join(
+                        log_dir, name.replace('@', '').replace('/', '-') + '.log')
+                    commands = get_build_commands(packages[name], prod)
+                    print('[started] %s' % name)
+                    future = pool.submit(
+                        _run_job, packages[name], commands, log_path)
+                    running[future] = (name, log_path)
+            if not running:
+                continue
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, log_path = running.pop(future)
+                returncode, duration = future.result()
+                status = 'failed' if returncode else 'ok'
+                results[name] = dict(status=status, duration=duration,
+                                     log=log_path)
+                print('[%s] %s in %.1fs' % (status, name, duration))
+    return results
+
+
+def print_build_summary(results, tail=20):
+    """Print the timings of the build jobs and the output of the failures."""
+    print('')
+    print('%-50s %8s %10s' % ('package', 'status', 'time (s)'))
+    for (name, result) in sorted(results.items(),
+                                 key=lambda item: -item[1]['duration']):
+        print('%-50s %8s %10.1f' % (name, result['status'], result['duration']))
+
+    failed = [n for (n, r) in sorted(results.items()) if r['status'] == 'failed']
+    for name in failed:
+        log_path = results[name]['log']
+        print('')
+        print('%s failed, the last lines of %s:' % (name, log_path))
+        with open(log_path) as fid:
+            lines = fid.readlines()
+        print(''.join(lines[-tail:]).rstrip())
+    skipped = [n for (n, r) in sorted(results.items()) if r['status'] == 'skipped']
+    if failed or skipped:
+        print('')
+        print('%s failed, %s skipped' % (len(failed), len(skipped)))
+
+
+def compress_file(path, encodings=None):
+    """Write precompressed siblings of a file.
+
+    Siblings that are up to date are left alone, and a sibling is only
+    written when it is smaller than the original.
+
+    Returns
+    -------
+    The list of sibling paths that were written.
+    """
+    encodings = encodings or [enc for (enc, _) in ENCODINGS]
+    source_mtime = os.stat(path).st_mtime
+    written = []
+    data = None
+    for (encoding, suffix) in ENCODINGS:
+        if encoding not in encodings:
+            continue
+        if encoding == 'br' and brotli is None:
+            continue
+        target = path + suffix
+        if osp.exists(target) and os.stat(target).st_mtime >= source_mtime:
+            continue
+        if data is None:
+            with open(path, 'rb') as fid:
+                data = fid.read()
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=11)
+        else:
+            # Use a fixed mtime so the output is reproducible.
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                               mtime=0) as fid:
+                fid.write(data)
+            compressed = buf.getvalue()
+        if len(compressed) >= len(data):
+            if osp.exists(target):
+                os.remove(target)
+            continue
+        tmp_path = target + '.tmp'
+        with open(tmp_path, 'wb') as fid:
+            fid.write(compressed)
+        os.replace(tmp_path, target)
+        written.append(target)
+    return written
+
+
+def compress_assets(paths, encodings=None):
+    """Write precompressed siblings of every compressible asset under the
+    given directories.
+
+    Returns
+    -------
+    The list of sibling paths that were written.
+    """
+    written = []
+    for path in paths:
+        for (root, dirnames, filenames) in os.walk(path):
+            for filename in filenames:
+                if not filename.endswith(COMPRESSIBLE_EXTENSIONS):
+                    continue
+                fullpath = osp.join(root, filename)
+                if os.stat(fullpath).st_size < MIN_COMPRESS_SIZE:
+                    continue
+                written.extend(compress_file(fullpath, encodings))
+    return written
+
+
+def _compress_command(args):
+    paths = args.paths
+    if not paths:
+        paths = [get_output_dir(p) for p in get_packages().values()]
+        paths = [p for p in paths if osp.isdir(p)]
+    if brotli is None:
+        print('brotli is not installed, only writing gzip assets')
+    written = compress_assets(paths)
+    print('Wrote %s precompressed assets' % len(written))
+
+
+def _themes_command(args):
+    # Only this command needs the server dependencies.
+    from themes import build_theme_bundles
+    paths = args.paths
+    if not paths:
+        paths = [osp.join(get_output_dir(p), 'themes')
+                 for p in get_packages().values()]
+    written = build_theme_bundles(paths)
+    print('Wrote %s theme bundles' % len(written))
+
+
+def _manifest_command(args):
+    # Only this command needs the server dependencies.
+    from serviceworker import write_asset_manifest
+    paths = args.paths
+    if not paths:
+        # The core bundle writes its own manifest as it is built.
+        paths = [get_output_dir(p) for p in get_packages().values()
+                 if 'buildDir' not in get_package_data(p)['jupyterlab']]
+        paths = [p for p in paths if osp.isdir(p)]
+    for path in paths:
+        write_asset_manifest(path)
+    print('Wrote %s asset manifests' % len(paths))
+
+
+def _packages_command(args):
+    packages = get_packages()
+    if args.packages:
+        # Select packages by name or by directory.
+        by_dir = dict((osp.basename(p), n) for (n, p) in packages.items())
+        selected = dict()
+        for key in args.packages:
+            name = by_dir.get(osp.basename(osp.normpath(key)), key)
+            if name not in packages:
+                raise SystemExit('Unknown package %s' % key)
+            selected[name] = packages[name]
+        packages = selected
+    results = build_packages(packages, jobs=args.jobs, prod=args.prod)
+    print_build_summary(results)
+    if any(r['status'] != 'ok' for r in results.values()):
+        return 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    packages = subparsers.add_parser(
+        'packages',
+        help='build the packages in parallel, in dependency order'
+    )
+    packages.add_argument(
+        'packages', nargs='*',
+        help='the package names or directories, defaults to every package'
+    )
+    packages.add_argument(
+        '--jobs', '-j', type=int, default=None,
+        help='the number of builds to run at once, defaults to the CPU count'
+    )
+    packages.add_argument(
+        '--prod', action='store_true', help='make production builds'
+    )
+    packages.set_defaults(func=_packages_command)
+
+    manifest = subparsers.add_parser(
+        'manifest',
+        help='write the asset manifest of each federated extension, for the '
+             'service worker to precache'
+    )
+    manifest.add_argument(
+        'paths', nargs='*',
+        help='the extension directories, defaults to the output directory '
+             'of every extension package'
+    )
+    manifest.set_defaults(func=_manifest_command)
+
+    themes = subparsers.add_parser(
+        'themes',
+        help='precompile each theme into a minified, content-hashed '
+             'stylesheet and a custom property map'
+    )
+    themes.add_argument(
+        'paths', nargs='*',
+        help='the themes directories, defaults to the themes output '
+             'directory of every package'
+    )
+    themes.set_defaults(func=_themes_command)
+
+    compress = subparsers.add_parser(
+        'compress',
+        help='write .gz and .br siblings for the static assets'
+    )
+    compress.add_argument(
+        'paths', nargs='*',
+        help='the asset directories, defaults to the output directory of '
+             'every package'
+    )
+    compress.set_defaults(func=_compress_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
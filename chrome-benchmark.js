@@ -0,0 +1,149 @@
+const fs = require('fs');
+const puppeteer = require('puppeteer');
+const URL = process.argv[2];
+const OUTPUT = process.argv[3];
+const RUNS = parseInt(process.argv[4] || '5', 10);
+const COMMIT = process.argv[5] || '';
+
+// The performance mark set by the core loader once the application is restored.
+const RESTORED_MARK = 'jupyterlab:restored';
+
+// The prefix of the per-remote performance measures set by the core loader.
+const REMOTE_PREFIX = 'jupyterlab:remote:';
+
+/**
+ * Load the application in a new page and measure its startup.
+ */
+async function measure(browser, url) {
+  const page = await browser.newPage();
+  const client = await page.target().createCDPSession();
+  await client.send('Network.enable');
+
+  let requests = 0;
+  let bytes = 0;
+  client.on('Network.requestWillBeSent', () => {
+    requests += 1;
+  });
+  client.on('Network.loadingFinished', event => {
+    bytes += event.encodedDataLength;
+  });
+
+  await page.goto(url);
+  await page.waitForFunction(
+    name => performance.getEntriesByName(name).length > 0,
+    { timeout: 100000 },
+    RESTORED_MARK
+  );
+
+  const timings = await page.evaluate(
+    (restoredMark, remotePrefix) => {
+      const remotes = {};
+      performance.getEntriesByType('measure').forEach(entry => {
+        const name = entry.name.slice(remotePrefix.length);
+        if (entry.name.startsWith(remotePrefix) && name.indexOf(':') === -1) {
+          remotes[name] = entry.duration;
+        }
+      });
+      return {
+        restored: performance.getEntriesByName(restoredMark)[0].startTime,
+        remotes
+      };
+    },
+    RESTORED_MARK,
+    REMOTE_PREFIX
+  );
+  const metrics = await page.metrics();
+  await page.close();
+
+  return {
+    restoredMs: timings.restored,
+    requests,
+    bytes,
+    scriptMs: metrics.ScriptDuration * 1000,
+    taskMs: metrics.TaskDuration * 1000,
+    remotes: timings.remotes
+  };
+}
+
+/**
+ * Get the median of a list of numbers.
+ */
+function median(values) {
+  const sorted = values.slice().sort((a, b) => a - b);
+  const middle = Math.floor(sorted.length / 2);
+  if (sorted.length % 2) {
+    return sorted[middle];
+  }
+  return (sorted[middle - 1] + sorted[middle]) / 2;
+}
+
+/**
+ * Summarize the runs of a benchmark with the median of every number.
+ */
+function summarize(runs) {
+  const summary = { remotes: {} };
+  ['restoredMs', 'requests', 'bytes', 'scriptMs', 'taskMs'].forEach(key => {
+    summary[key] = median(runs.map(run => run[key]));
+  });
+  const names = new Set();
+  runs.forEach(run => Object.keys(run.remotes).forEach(name => names.add(name)));
+  names.forEach(name => {
+    summary.remotes[name] = median(
+      runs.filter(run => name in run.remotes).map(run => run.remotes[name])
+    );
+  });
+  return summary;
+}
+
+async function main() {
+  /* eslint-disable no-console */
+  console.info('Starting Chrome Headless');
+
+  const browser = await puppeteer.launch({ args: ['--no-sandbox'] });
+
+  // Resolve the application url, which may be behind a local redirect file.
+  const page = await browser.newPage();
+  console.info('Navigating to page:', URL);
+  await page.goto(URL);
+  if (URL.startsWith('file:')) {
+    await page.waitForNavigation();
+  }
+  const appUrl = page.url();
+  await page.close();
+
+  const client = await (await browser.newPage()).target().createCDPSession();
+  await client.send('Network.enable');
+
+  const cold = [];
+  for (let i = 0; i < RUNS; i++) {
+    await client.send('Network.clearBrowserCache');
+    cold.push(await measure(browser, appUrl));
+    console.info(`Cold run ${i + 1}/${RUNS}: ${cold[i].restoredMs.toFixed(1)} ms`);
+  }
+
+  // The last cold run leaves the cache warm.
+  const warm = [];
+  for (let i = 0; i < RUNS; i++) {
+    warm.push(await measure(browser, appUrl));
+    console.info(`Warm run ${i + 1}/${RUNS}: ${warm[i].restoredMs.toFixed(1)} ms`);
+  }
+
+  await browser.close();
+
+  const result = {
+    commit: COMMIT,
+    date: new Date().toISOString(),
+    runs: RUNS,
+    cold: { summary: summarize(cold), runs: cold },
+    warm: { summary: summarize(warm), runs: warm }
+  };
+  fs.writeFileSync(OUTPUT, JSON.stringify(result, null, 2) + '\n');
+  console.info('Wrote benchmark results to', OUTPUT);
+}
+
+// Stop the process if an error is raised in the async function.
+process.on('unhandledRejection', up => {
+  throw up;
+});
+
+main();
@@ -1,7 +1,15 @@
 // Copyright (c) Jupyter Development Team.
 // Distributed under the terms of the Modified BSD License.
 
-import { PageConfig } from '@jupyterlab/coreutils';
+import { PageConfig, PathExt, URLExt } from '@jupyterlab/coreutils';
+import {
+  ABCWidgetFactory,
+  DocumentWidget,
+  MimeDocumentFactory
+} from '@jupyterlab/docregistry';
+import { IRenderMimeRegistry } from '@jupyterlab/rendermime';
+import { ServerConnection } from '@jupyterlab/services';
+import { PanelLayout, Widget } from '@lumino/widgets';
 
 // This must be after the public path is set.
 // This cannot be extracted because the public path is dynamic.
@@ -18,20 +26,444 @@ function loadScript(url) {
   });
 }
 
-async function loadComponent(url, scope, module) {
-  await loadScript(url);
+/**
+ * Record a performance measure that ends now.
+ *
+ * The measure starts at the mark of the same name with a `:start` suffix.
+ */
+function measure(name) {
+  performance.measure(name, `${name}:start`);
+  return performance.getEntriesByName(name, 'measure').pop().duration;
+}
+
+/**
+ * Load the federated containers of the dynamic extensions.
+ *
+ * All the remote entries are fetched concurrently, the default share scope
+ * is initialized once, and then every container is initialized and asked
+ * for its module in parallel.  A container that fails to load is skipped.
+ *
+ * The time each container spends in each phase is recorded as performance
+ * measures named `jupyterlab:remote:<name>:<phase>`, and the totals as
+ * `jupyterlab:remote:<name>`.
+ */
+async function loadComponents(baseUrl, extensionData) {
+  const timings = {};
+  const failed = new Set();
 
   // From MIT-licensed https://github.com/module-federation/module-federation-examples/blob/af043acd6be1718ee195b2511adf6011fba4233c/advanced-api/dynamic-remotes/app1/src/App.js#L6-L12
-  await __webpack_init_sharing__('default');
-  const container = window._JUPYTERLAB[scope];
-  // Initialize the container, it may provide shared modules and may need ours
-  await container.init(__webpack_share_scopes__.default);
-
-  const factory = await window._JUPYTERLAB[scope].get(module);
-  const Module = factory();
-  return Module;
+  const sharing = __webpack_init_sharing__('default');
+
+  async function phase(data, name, callback) {
+    if (failed.has(data.name)) {
+      return undefined;
+    }
+    const key = `jupyterlab:remote:${data.name}`;
+    performance.mark(`${key}:${name}:start`);
+    try {
+      return await callback();
+    } catch (reason) {
+      failed.add(data.name);
+      console.error(`Failed to ${name} the ${data.name} container`, reason);
+      return undefined;
+    } finally {
+      timings[data.name] = timings[data.name] || {};
+      timings[data.name][name] = measure(`${key}:${name}`);
+    }
+  }
+
+  extensionData.forEach(data => {
+    performance.mark(`jupyterlab:remote:${data.name}:start`);
+  });
+
+  // The container may already be defined by the combined remote entries.
+  await Promise.all(
+    extensionData.map(data =>
+      phase(data, 'load', () => {
+        if (!(window._JUPYTERLAB && window._JUPYTERLAB[data.name])) {
+          return loadScript(URLExt.join(baseUrl, data.path));
+        }
+      })
+    )
+  );
+  await sharing;
+
+  // Initialize every container before getting any module, so that all the
+  // shared modules are registered before any is consumed.
+  await Promise.all(
+    extensionData.map(data =>
+      phase(data, 'init', () =>
+        window._JUPYTERLAB[data.name].init(__webpack_share_scopes__.default)
+      )
+    )
+  );
+
+  const modules = await Promise.all(
+    extensionData.map(data =>
+      phase(data, 'get', async () => {
+        const factory = await window._JUPYTERLAB[data.name].get(data.module);
+        return factory();
+      })
+    )
+  );
+
+  extensionData.forEach(data => {
+    timings[data.name].total = measure(`jupyterlab:remote:${data.name}`);
+  });
+  if (extensionData.length) {
+    console.debug('Federated extension load timings (ms)', timings);
+  }
+  return modules;
 }
 
+/**
+ * Get the plugins or mime extensions exported by an extension module.
+ */
+function getExports(extMod) {
+  let extension = extMod.default;
+
+  // Handle CommonJS exports.
+  if (!extMod.hasOwnProperty('__esModule')) {
+    extension = extMod;
+  }
+  return Array.isArray(extension) ? extension : [extension];
+}
+
+/**
+ * Register the mime extensions of a module with a started application.
+ *
+ * This mirrors what the application does for the mime extensions it is
+ * constructed with, except that the documents are not tracked for
+ * layout restoration.
+ */
+function registerMimeExtensions(app, rendermime, extMod) {
+  const registry = app.docRegistry;
+  getExports(extMod).forEach(ext => {
+    rendermime.addFactory(ext.rendererFactory, ext.rank);
+    if (!ext.documentWidgetFactoryOptions) {
+      return;
+    }
+    (ext.fileTypes || []).forEach(ft => {
+      registry.addFileType(ft);
+    });
+    const options = Array.isArray(ext.documentWidgetFactoryOptions)
+      ? ext.documentWidgetFactoryOptions
+      : [ext.documentWidgetFactoryOptions];
+    options.forEach(option => {
+      registry.addWidgetFactory(
+        new MimeDocumentFactory({
+          renderTimeout: ext.renderTimeout,
+          dataType: ext.dataType,
+          rendermime,
+          modelName: option.modelName,
+          name: option.name,
+          primaryFileType: registry.getFileType(option.primaryFileType),
+          fileTypes: option.fileTypes,
+          defaultFor: option.defaultFor,
+          defaultRendered: option.defaultRendered
+        })
+      );
+    });
+  });
+}
+
+/**
+ * A renderer standing in for a mime type of a lazy extension.
+ *
+ * The first render loads the extension, and the model is then rendered
+ * with the renderer factory the extension registered.
+ */
+class LazyRenderer extends Widget {
+  constructor(options, rendermime, load) {
+    super();
+    this.layout = new PanelLayout();
+    this._options = options;
+    this._rendermime = rendermime;
+    this._load = load;
+    this._renderer = null;
+  }
+
+  async renderModel(model) {
+    if (!this._renderer) {
+      await this._load();
+      const mimeType = this._options.mimeType;
+      const factory = this._rendermime.getFactory(mimeType);
+      if (!factory || factory.isLazy) {
+        throw new Error(`No renderer was registered for ${mimeType}`);
+      }
+      this._renderer = factory.createRenderer(this._options);
+      this.layout.addWidget(this._renderer);
+    }
+    return this._renderer.renderModel(model);
+  }
+}
+
+/**
+ * A widget factory standing in for the file types of a lazy extension.
+ *
+ * It creates an empty document widget and calls `load` with it, which loads
+ * the extension and then opens the document again with the factory the
+ * registry picks once the extension is active.
+ */
+class LazyWidgetFactory extends ABCWidgetFactory {
+  constructor(options, load) {
+    super(options);
+    this._load = load;
+  }
+
+  createNewWidget(context) {
+    const widget = new DocumentWidget({ content: new Widget(), context });
+    widget.title.label = PathExt.basename(context.path);
+    this._load(widget);
+    return widget;
+  }
+}
+
+/**
+ * Create the plugin that loads the extensions with activation triggers.
+ *
+ * An extension is loaded and activated the first time one of its triggers
+ * fires:
+ *
+ * - `commands`: one of the commands is executed.  A placeholder command is
+ *   registered until the extension registers the real one.
+ * - `fileTypes`: a path of one of the file types is opened.  Until the
+ *   extension is loaded, the default widget factory for the file types is
+ *   a placeholder, so the document is opened with the factories the
+ *   extension registers.
+ * - `mimeTypes`: data of one of the mime types is rendered, and no other
+ *   renderer is registered for it.
+ */
+function createLazyPlugin(baseUrl, lazyData) {
+  return {
+    id: '@jupyterlab/example-federated-core:lazy-extensions',
+    requires: [IRenderMimeRegistry],
+    autoStart: true,
+    activate: (app, rendermime) => {
+      const activations = {};
+      const placeholders = {};
+      const fileTypes = {};
+
+      function activate(data) {
+        if (!activations[data.name]) {
+          activations[data.name] = (async () => {
+            const [extMod] = await loadComponents(baseUrl, [data]);
+            if (!extMod) {
+              throw new Error(`Failed to load ${data.name}`);
+            }
+            (placeholders[data.name] || []).forEach(d => d.dispose());
+            if (data.mime) {
+              registerMimeExtensions(app, rendermime, extMod);
+              return;
+            }
+            app.registerPluginModule(extMod);
+            await Promise.all(
+              getExports(extMod)
+                .filter(plugin => plugin.autoStart)
+                .filter(plugin => !PageConfig.Extension.isDisabled(plugin.id))
+                .map(plugin => app.activatePlugin(plugin.id))
+            );
+          })();
+        }
+        return activations[data.name];
+      }
+
+      function activateForPath(path) {
+        app.docRegistry.getFileTypesForPath(path).forEach(ft => {
+          (fileTypes[ft.name] || []).forEach(data => {
+            activate(data).catch(reason => { console.error(reason); });
+          });
+          delete fileTypes[ft.name];
+        });
+      }
+
+      lazyData.forEach(data => {
+        const triggers = data.triggers;
+        placeholders[data.name] = (triggers.commands || [])
+          .filter(id => !app.commands.hasCommand(id))
+          .map(id =>
+            app.commands.addCommand(id, {
+              execute: async args => {
+                await activate(data);
+                return app.commands.execute(id, args);
+              }
+            })
+          );
+
+        (triggers.fileTypes || []).forEach(name => {
+          (fileTypes[name] = fileTypes[name] || []).push(data);
+        });
+
+        // Do not shadow a renderer that is already registered.
+        const mimeTypes = (triggers.mimeTypes || []).filter(
+          mimeType => rendermime.mimeTypes.indexOf(mimeType) === -1
+        );
+        if (mimeTypes.length) {
+          rendermime.addFactory({
+            safe: false,
+            isLazy: true,
+            mimeTypes,
+            createRenderer: options =>
+              new LazyRenderer(options, rendermime, () => activate(data))
+          });
+        }
+      });
+
+      // Stand in for the file types that are already registered, so that
+      // their documents are only opened once the extensions are loaded.
+      const registry = app.docRegistry;
+      const lazyFactories = {};
+      Object.keys(fileTypes).forEach(name => {
+        if (!registry.getFileType(name)) {
+          return;
+        }
+        const lazyData = fileTypes[name];
+        delete fileTypes[name];
+        const open = (widget, rendered) => {
+          const path = widget.context.path;
+          Promise.all(lazyData.map(activate))
+            .catch(reason => {
+              console.error(reason);
+            })
+            .then(() => {
+              (lazyFactories[name] || []).forEach(lazy => {
+                lazy.disposable.dispose();
+              });
+              delete lazyFactories[name];
+              const factory = rendered
+                ? registry.defaultRenderedWidgetFactory(path)
+                : registry.defaultWidgetFactory(path);
+              return app.commands.execute('docmanager:open', {
+                path,
+                factory: factory ? factory.name : undefined
+              });
+            })
+            .then(() => {
+              widget.dispose();
+            });
+        };
+        lazyFactories[name] = [false, true].map(rendered => {
+          const factory = new LazyWidgetFactory(
+            {
+              name: `${name} (loading${rendered ? ', rendered' : ''})`,
+              fileTypes: [name]
+            },
+            widget => open(widget, rendered)
+          );
+          return { factory, disposable: registry.addWidgetFactory(factory) };
+        });
+      });
+
+      // The document manager opens a path with the default factory, which
+      // is the placeholder until the extension is loaded.
+      function getLazyFactory(path, rendered) {
+        const fileType = path
+          ? registry
+              .getFileTypesForPath(path)
+              .find(ft => lazyFactories[ft.name])
+          : undefined;
+        return fileType
+          ? lazyFactories[fileType.name][rendered ? 1 : 0].factory
+          : undefined;
+      }
+      const defaultWidgetFactory = registry.defaultWidgetFactory.bind(registry);
+      const defaultRenderedWidgetFactory = registry.defaultRenderedWidgetFactory.bind(
+        registry
+      );
+      registry.defaultWidgetFactory = path =>
+        getLazyFactory(path, false) || defaultWidgetFactory(path);
+      registry.defaultRenderedWidgetFactory = path =>
+        getLazyFactory(path, true) || defaultRenderedWidgetFactory(path);
+
+      // The other file types may be registered by the extensions, so watch
+      // the commands that are executed for a path argument, and the
+      // documents that get focus.
+      app.commands.commandExecuted.connect((_, args) => {
+        const path = args.args && args.args.path;
+        if (typeof path === 'string') {
+          activateForPath(path);
+        }
+      });
+      if (app.shell.currentChanged) {
+        app.shell.currentChanged.connect((_, args) => {
+          const context = args.newValue && args.newValue.context;
+          if (context && typeof context.path === 'string') {
+            activateForPath(context.path);
+          }
+        });
+      }
+    }
+  };
+}
+
+/**
+ * Serve the first fetch of each plugin's settings from a single request for
+ * the settings of every plugin.
+ *
+ * The settings registry fetches the settings of each plugin as it loads, so
+ * the listing is requested up front and each entry of it is used once.  A
+ * plugin that is not in the listing, or that is saved before its entry is
+ * used, is fetched on its own.
+ */
+function batchSettings(manager) {
+  const fetch = manager.fetch.bind(manager);
+  const save = manager.save.bind(manager);
+  const serverSettings = manager.serverSettings;
+  const url = URLExt.join(
+    serverSettings.baseUrl,
+    PageConfig.getOption('settingsUrl')
+  );
+  const batch = ServerConnection.makeRequest(url, {}, serverSettings)
+    .then(response => (response.ok ? response.json() : { settings: [] }))
+    .then(data => new Map(data.settings.map(plugin => [plugin.id, plugin])))
+    .catch(reason => {
+      console.warn('Failed to fetch the settings of all plugins', reason);
+      return new Map();
+    });
+
+  manager.fetch = async id => {
+    const plugins = await batch;
+    const plugin = plugins.get(id);
+    if (plugin) {
+      plugins.delete(id);
+      return plugin;
+    }
+    return fetch(id);
+  };
+  manager.save = async (id, raw) => {
+    (await batch).delete(id);
+    return save(id, raw);
+  };
+}
+
+/**
+ * Register the service worker that precaches the assets, or unregister it
+ * once the server no longer serves one.
+ *
+ * The worker controls the lab pages, and serves the assets they load from
+ * its cache as long as the page was rendered for the same assets.
+ */
+function registerServiceWorker(baseUrl) {
+  if (!('serviceWorker' in navigator)) {
+    return;
+  }
+  const url = PageConfig.getOption('serviceWorkerUrl');
+  const scope = URLExt.join(baseUrl, 'lab');
+  if (url) {
+    navigator.serviceWorker
+      .register(URLExt.join(baseUrl, url), { scope })
+      .catch(reason => {
+        console.warn('Failed to register the service worker', reason);
+      });
+    return;
+  }
+  const scopeUrl = new URL(scope, window.location.href).href;
+  navigator.serviceWorker.getRegistrations().then(registrations => {
+    registrations
+      .filter(registration => registration.scope === scopeUrl)
+      .forEach(registration => registration.unregister());
+  });
+}
 
 /**
  * The main entry point for the application.
@@ -52,25 +484,49 @@ async function main() {
     PageConfig.getOption('dynamic_mime_extensions')
   );
 
+  // Load from the same absolute urls as the preload hints in the page,
+  // so that the preloaded responses are reused.
+  const baseUrl = PageConfig.getBaseUrl();
+
+  // Load all the remote entries in one request when the server combines
+  // them.  Any container it fails to define is loaded on its own below.
+  const remoteEntriesUrl = PageConfig.getOption('dynamic_remote_entries');
+  if (remoteEntriesUrl) {
+    try {
+      await loadScript(URLExt.join(baseUrl, remoteEntriesUrl));
+    } catch (e) {
+      console.warn('Failed to load the combined remote entries', e);
+    }
+  }
+
+  // Extensions with activation triggers are only loaded when needed.
+  const isEager = data => !data.triggers;
+  const eagerData = extension_data.filter(isEager);
+  const eagerMimeData = mime_extension_data.filter(isEager);
+  const lazyData = extension_data
+    .filter(data => !isEager(data))
+    .map(data => Object.assign({ mime: false }, data))
+    .concat(
+      mime_extension_data
+        .filter(data => !isEager(data))
+        .map(data => Object.assign({ mime: true }, data))
+    );
+
   // Get dynamic plugins
   // TODO: deconflict these with builtins?
-  const dynamicPromises = extension_data.map(data =>
-    loadComponent(
-      data.path,
-      data.name,
-      data.module
-    )
+  const dynamicModules = await loadComponents(
+    baseUrl,
+    eagerData.concat(eagerMimeData)
   );
-  const dynamicPlugins = await Promise.all(dynamicPromises);
-
-  const dynamicMimePromises = mime_extension_data.map(data =>
-    loadComponent(
-      data.path,
-      data.name,
-      data.module
-    )
-  );
-  const dynamicMimePlugins = await Promise.all(dynamicMimePromises);
+  const dynamicPlugins = dynamicModules
+    .slice(0, eagerData.length)
+    .filter(Boolean);
+  const dynamicMimePlugins = dynamicModules
+    .slice(eagerData.length)
+    .filter(Boolean);
+  if (lazyData.length) {
+    dynamicPlugins.push(createLazyPlugin(baseUrl, lazyData));
+  }
 
   // Handle the registered mime extensions.
   var mimeExtensions = [];
@@ -151,9 +607,20 @@ async function main() {
         .map(function (val) { return val.raw; })
     },
   });
+  batchSettings(lab.serviceManager.settings);
   register.forEach(function(item) { lab.registerPluginModule(item); });
   lab.start({ ignorePlugins: ignorePlugins });
 
+  // Mark the restoration for startup benchmarks.
+  lab.restored
+    .then(function() { performance.mark('jupyterlab:restored'); })
+    .catch(function() { /* Reported by the browser test. */ });
+
+  // Precache the assets once the page no longer competes for them.
+  lab.restored
+    .then(function() { registerServiceWorker(baseUrl); })
+    .catch(function() { /* Reported by the browser test. */ });
+
   // Expose global app instance when in dev mode or when toggled explicitly.
   var exposeAppInBrowser = (PageConfig.getOption('exposeAppInBrowser') || '').toLowerCase() === 'true';
   var devMode = (PageConfig.getOption('devMode') || '').toLowerCase() === 'true';
@@ -6,7 +6,9 @@ const webpack = require('webpack');
 const { merge } = require('webpack-merge');
 const baseConfig = require('@jupyterlab/buildutils/lib/webpack.config.base');
 const { ModuleFederationPlugin } = webpack.container;
+const crypto = require('crypto');
 const fs = require('fs-extra');
+const glob = require('glob');
 const path = require('path');
 const Handlebars = require('handlebars');
 
@@ -17,18 +19,160 @@ const names = Object.keys(data.dependencies).filter(function(name) {
 
 const jlab = data.jupyterlab;
 
-// Ensure a clear build directory.
+// The build directory is kept between builds, so that unchanged outputs
+// can be reused.
 const buildDir = path.resolve(jlab.buildDir);
-if (fs.existsSync(buildDir)) {
-  fs.removeSync(buildDir);
-}
 fs.ensureDirSync(buildDir);
 
-const extras = Build.ensureAssets({
-  packageNames: names,
-  output: jlab.outputDir
+// The fingerprints of the packages whose assets were last extracted.
+const cacheDir = path.resolve('node_modules', '.cache', 'example-federated-core');
+const assetsCachePath = path.join(cacheDir, 'assets.json');
+
+/**
+ * Write a file only if its contents change, so its mtime is only bumped
+ * when the build actually needs to see it again.
+ */
+function writeIfChanged(filePath, contents) {
+  if (
+    fs.existsSync(filePath) &&
+    fs.readFileSync(filePath).toString() === contents
+  ) {
+    return false;
+  }
+  fs.writeFileSync(filePath, contents);
+  return true;
+}
+
+/**
+ * Get a fingerprint of the files of a package that asset extraction reads:
+ * its package data, schemas and theme files.
+ */
+function getAssetsFingerprint(name) {
+  const packageDataPath = require.resolve(path.join(name, 'package.json'));
+  const packageDir = path.dirname(packageDataPath);
+  const packageData = fs.readFileSync(packageDataPath);
+  const { schemaDir, themePath } = JSON.parse(packageData).jupyterlab || {};
+  const hash = crypto.createHash('sha256');
+  hash.update(packageData);
+  [schemaDir, themePath && path.dirname(themePath)]
+    .filter(Boolean)
+    .forEach(dir => {
+      glob.sync(path.join(packageDir, dir, '**', '*'), { nodir: true })
+        .sort()
+        .forEach(file => {
+          const stat = fs.statSync(file);
+          hash.update(`${file}:${stat.size}:${stat.mtimeMs}\n`);
+        });
+    });
+  return hash.digest('hex');
+}
+
+/**
+ * Get the contents of `imports.css`, which imports the styles of the given
+ * packages, as `Build.ensureAssets` writes it.
+ */
+function getCSSImports(packageNames) {
+  const imports = [];
+  packageNames.forEach(name => {
+    const packageData = require(name + '/package.json');
+    const style = packageData.styleModule || packageData.style;
+    if (typeof style === 'string') {
+      imports.push(`@import url('~${name}/${style}');`);
+    }
+  });
+  imports.sort((a, b) => a.localeCompare(b));
+  return imports.join('\n') + '\n';
+}
+
+// Only extract the assets of the packages that changed, or whose theme was
+// never built.
+let assetsCache = {};
+try {
+  assetsCache = fs.readJSONSync(assetsCachePath);
+} catch (e) {
+  // The cache is missing or invalid.
+}
+const fingerprints = {};
+names.forEach(name => {
+  fingerprints[name] = getAssetsFingerprint(name);
+});
+const changed = names.filter(name => {
+  const { themePath } = require(name + '/package.json').jupyterlab || {};
+  return (
+    assetsCache[name] !== fingerprints[name] ||
+    (themePath && !fs.existsSync(path.join(jlab.outputDir, 'themes', name)))
+  );
+});
+const removed = Object.keys(assetsCache).filter(name => !(name in fingerprints));
+removed.forEach(name => {
+  fs.removeSync(path.join(jlab.outputDir, 'schemas', name));
+  fs.removeSync(path.join(jlab.outputDir, 'themes', name));
 });
 
+let extras = [];
+if (changed.length) {
+  extras = Build.ensureAssets({
+    packageNames: changed,
+    output: jlab.outputDir
+  });
+}
+// `Build.ensureAssets` only imports the styles of the packages it is given,
+// so the imports of all the packages are written afterwards.
+writeIfChanged(
+  path.join(jlab.outputDir, 'imports.css'),
+  getCSSImports(names)
+);
+
+/**
+ * A plugin that records the fingerprints of the extracted assets once the
+ * build succeeds.
+ */
+const assetsCachePlugin = {
+  apply: compiler => {
+    compiler.hooks.done.tap('AssetsCachePlugin', stats => {
+      if (!stats.hasErrors()) {
+        fs.ensureDirSync(cacheDir);
+        fs.writeJSONSync(assetsCachePath, fingerprints);
+      }
+    });
+  }
+};
+
+// The asset types worth precaching, as in `serviceworker.py`.
+const precacheRe = /\.(css|eot|gif|js|otf|png|svg|ttf|woff2?)$/;
+
+/**
+ * A plugin that writes the asset manifest of the bundle, which maps each
+ * asset to a truncated sha256 of its content, for the service worker to
+ * precache.
+ */
+const assetManifestPlugin = {
+  apply: compiler => {
+    compiler.hooks.done.tap('AssetManifestPlugin', stats => {
+      if (stats.hasErrors()) {
+        return;
+      }
+      const compilation = stats.compilation;
+      const files = {};
+      Object.keys(compilation.assets)
+        .filter(name => precacheRe.test(name))
+        .sort()
+        .forEach(name => {
+          files[name] = crypto
+            .createHash('sha256')
+            .update(compilation.assets[name].source())
+            .digest('hex')
+            .slice(0, 20);
+        });
+      const manifestPath = path.join(
+        compilation.outputOptions.path,
+        'asset-manifest.json'
+      );
+      writeIfChanged(manifestPath, JSON.stringify({ files }, null, 2) + '\n');
+    });
+  }
+};
+
 // TODO: make options configurable
 
 const singletons = {};
@@ -70,21 +214,40 @@ const extData = {
 };
 const result = template(extData);
 
-fs.writeFileSync(path.join(buildDir, 'index.out.js'), result);
+writeIfChanged(path.join(buildDir, 'index.out.js'), result);
 
 // Make a bootstrap entrypoint
 const entryPoint = path.join(buildDir, 'bootstrap.js');
 const bootstrap = 'import("./index.out.js");'
-fs.writeFileSync(entryPoint, bootstrap);
+writeIfChanged(entryPoint, bootstrap);
 
 
 if (process.env.NODE_ENV === 'production') {
   baseConfig.mode = 'production';
 }
 
+// Keep separate caches for the modes, which may be given on the command line.
+const modeArg = process.argv.find(arg => arg.startsWith('--mode'));
+const mode =
+  modeArg === '--mode'
+    ? process.argv[process.argv.indexOf(modeArg) + 1]
+    : modeArg
+    ? modeArg.split('=')[1]
+    : baseConfig.mode || 'development';
+
 module.exports = [
   merge(baseConfig, {
     entry: entryPoint,
+    // Persist the module cache between builds, keyed by the mode.  It is
+    // invalidated when this config or the package data change.
+    cache: {
+      type: 'filesystem',
+      name: mode,
+      cacheDirectory: path.join(cacheDir, 'webpack'),
+      buildDependencies: {
+        config: [__filename, path.resolve('package.json')]
+      }
+    },
     output: {
       path: path.resolve(jlab.outputDir),
       library: {
@@ -108,6 +271,8 @@ module.exports = [
         }]
     },
     plugins: [
+      assetsCachePlugin,
+      assetManifestPlugin,
       new ModuleFederationPlugin({
         library: {
           type: 'var',
@@ -0,0 +1,418 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Discovery of federated lab extensions installed in the `labextensions`
+paths, backed by a persistent on-disk index.
+
+The index records a stat signature for every labextensions directory (and
+`@scope` directory) and for every extension's package metadata.  A warm start
+only stats those paths and reads the index file, and a changed extension is
+the only one whose `package.json` is parsed again.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+# Bump when the layout of the index file changes, or when the entries it
+# may hold are no longer accepted.
+INDEX_VERSION = 3
+
+# The package metadata files written by `jupyter labextension build`,
+# in order of preference.
+PACKAGE_FILES = ('package.json', 'package.orig.json')
+
+# The module federation container of an extension.
+REMOTE_ENTRY = 'remoteEntry.js'
+
+# The kinds of `activationTriggers` an extension can declare in its
+# `jupyterlab` metadata to be loaded lazily.
+ACTIVATION_TRIGGERS = ('commands', 'fileTypes', 'mimeTypes')
+
+
+def stat_signature(path):
+    """Get a JSON-serializable stat signature for a path, or None if missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def hash_file(path, length=20):
+    """Get a truncated sha256 hex digest of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+class ExtensionIndex(object):
+    """An on-disk index of the federated extensions in a set of labextensions
+    paths.
+
+    Parameters
+    ----------
+    paths: list of str
+        The labextensions directories, in order of precedence.
+    index_path: str, optional
+        The file used to persist the index between server starts.
+    log: logging.Logger, optional
+        The logger to use.
+    metrics: metrics.LabMetrics, optional
+        The metrics to record the refresh durations in.
+    """
+
+    def __init__(self, paths, index_path=None, log=None, metrics=None):
+        self.paths = [os.path.abspath(p) for p in paths]
+        self.index_path = index_path
+        self.log = log or logging.getLogger(__name__)
+        self.metrics = metrics
+        # Directory -> [signature, sorted child names].
+        self._dirs = {}
+        # Extension directory -> extension data.
+        self._entries = {}
+        self._extensions = OrderedDict()
+        self._loaded = False
+
+    @property
+    def extensions(self):
+        """An ordered mapping of extension name to extension data.
+
+        When an extension is installed in several paths the one in the
+        path with the highest precedence wins.
+        """
+        return self._extensions
+
+    def refresh(self):
+        """Revalidate the index against the filesystem.
+
+        Returns
+        -------
+        The set of extension names that were added, removed or changed.
+        """
+        if self.metrics is None:
+            return self._refresh()
+        with self.metrics.discovery_seconds.time():
+            return self._refresh()
+
+    def _refresh(self):
+        if not self._loaded:
+            self._read_index()
+            self._loaded = True
+
+        dirs = {}
+        entries = {}
+        extensions = OrderedDict()
+        for root in self.paths:
+            for ext_path in self._list_dir(root, dirs):
+                entry = self._get_entry(ext_path)
+                if entry is None:
+                    continue
+                entry['ext_dir'] = root
+                entries[ext_path] = entry
+                extensions.setdefault(entry['name'], entry)
+
+        changed = set(self._extensions) ^ set(extensions)
+        for (name, entry) in extensions.items():
+            old = self._extensions.get(name)
+            if old is not None and old != entry:
+                changed.add(name)
+
+        dirty = dirs != self._dirs or entries != self._entries
+        self._dirs = dirs
+        self._entries = entries
+        self._extensions = extensions
+        if dirty:
+            self._write_index()
+        return changed
+
+    def _list_dir(self, path, dirs):
+        """Yield the extension directories in a labextensions directory,
+        descending into `@scope` directories.
+        """
+        sig = stat_signature(path)
+        if sig is None:
+            return
+        cached = self._dirs.get(path)
+        if cached and cached[0] == sig:
+            children = cached[1]
+        else:
+            try:
+                children = sorted(
+                    name for name in os.listdir(path)
+                    if os.path.isdir(os.path.join(path, name))
+                )
+            except OSError as e:
+                self.log.warning('Could not list %s: %s', path, e)
+                return
+        dirs[path] = [sig, children]
+        for name in children:
+            child = os.path.join(path, name)
+            if name.startswith('@'):
+                for ext_path in self._list_dir(child, dirs):
+                    yield ext_path
+            else:
+                yield child
+
+    def _get_entry(self, ext_path):
+        """Get the data for an extension directory, reusing the indexed data
+        when its package metadata and remote entry are unchanged.
+        """
+        entry = self._entries.get(ext_path)
+        if entry is None or entry['signature'] != stat_signature(entry['package_path']):
+            entry = self._read_entry(ext_path)
+            if entry is None:
+                return None
+
+        remote_entry = os.path.join(ext_path, REMOTE_ENTRY)
+        sig = stat_signature(remote_entry)
+        if sig != entry.get('remote_entry_signature'):
+            try:
+                digest = hash_file(remote_entry) if sig else None
+            except OSError as e:
+                self.log.warning('Could not read %s: %s', remote_entry, e)
+                digest = None
+            entry = dict(entry, remote_entry_signature=sig,
+                         remote_entry_hash=digest)
+        return entry
+
+    def _read_entry(self, ext_path):
+        """Read the package metadata of an extension directory."""
+        for fname in PACKAGE_FILES:
+            package_path = os.path.join(ext_path, fname)
+            sig = stat_signature(package_path)
+            if sig is not None:
+                break
+        else:
+            return None
+
+        try:
+            with open(package_path) as fid:
+                data = json.load(fid)
+        except (OSError, ValueError) as e:
+            self.log.warning('Could not read %s: %s', package_path, e)
+            return None
+
+        try:
+            name = data['name']
+            version = data.get('version', '')
+            jupyterlab = data.get('jupyterlab', dict())
+        except (KeyError, TypeError, AttributeError) as e:
+            self.log.warning('Skipping extension with invalid package data '
+                             '%s: %r', package_path, e)
+            return None
+        if not isinstance(name, str) or not isinstance(jupyterlab, dict):
+            self.log.warning('Skipping extension with invalid package data '
+                             '%s: the name must be a string and the '
+                             'jupyterlab data an object', package_path)
+            return None
+
+        return dict(
+            name=name,
+            version=version,
+            jupyterlab=jupyterlab,
+            ext_path=ext_path,
+            package_path=package_path,
+            signature=sig
+        )
+
+    def _read_index(self):
+        """Load the persisted index, if it is valid for our paths."""
+        if not self.index_path or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as fid:
+                data = json.load(fid)
+        except (OSError, ValueError) as e:
+            self.log.warning('Ignoring invalid extension index %s: %s',
+                             self.index_path, e)
+            return
+        if data.get('version') != INDEX_VERSION:
+            return
+        if data.get('paths') != self.paths:
+            return
+        self._dirs = data['dirs']
+        self._entries = data['extensions']
+
+    def _write_index(self):
+        """Atomically persist the index."""
+        if not self.index_path:
+            return
+        data = dict(
+            version=INDEX_VERSION,
+            paths=self.paths,
+            dirs=self._dirs,
+            extensions=self._entries
+        )
+        # Pre-forked workers may write the index at the same time.
+        tmp_path = '%s.%i.tmp' % (self.index_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(tmp_path, 'w') as fid:
+                json.dump(data, fid)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            self.log.warning('Could not write extension index %s: %s',
+                             self.index_path, e)
+
+
+class ExtensionWatcher(object):
+    """Poll an extension index in the background and keep the dynamic
+    extension data in a page config up to date.
+
+    Parameters
+    ----------
+    index: ExtensionIndex
+        The index to revalidate.
+    page_config: dict
+        The page config whose `dynamic_extensions` and
+        `dynamic_mime_extensions` lists are updated in place.
+    interval: float, optional
+        The polling interval in seconds.
+    combine_remote_entries: bool, optional
+        Whether to publish the url of the combined remote entries script
+        as `dynamic_remote_entries`.
+    file_indexes: list of assets.FileIndex, optional
+        The indexes of served files to revalidate on each poll, before the
+        extensions, so the files of a new extension resolve by the time it
+        is published.
+    log: logging.Logger, optional
+        The logger to use.
+    """
+
+    def __init__(self, index, page_config, interval=2.0,
+                 combine_remote_entries=False, file_indexes=(), log=None):
+        self.index = index
+        self.page_config = page_config
+        self.interval = interval
+        self.combine_remote_entries = combine_remote_entries
+        self.file_indexes = list(file_indexes)
+        self.log = log or logging.getLogger(__name__)
+        self.version = None
+        self._callback = None
+        self._pending = None
+        self._update()
+
+    def start(self):
+        """Start polling."""
+        if self._callback is None:
+            self._callback = PeriodicCallback(self._poll, self.interval * 1000)
+        self._callback.start()
+
+    def stop(self):
+        """Stop polling."""
+        if self._callback is not None:
+            self._callback.stop()
+
+    def _poll(self):
+        # The filesystem access happens off the event loop, and we never
+        # have more than one refresh in flight.
+        if self._pending is not None:
+            return
+        loop = IOLoop.current()
+        self._pending = loop.run_in_executor(None, self._refresh)
+        loop.add_future(self._pending, self._on_refresh)
+
+    def _refresh(self):
+        for file_index in self.file_indexes:
+            file_index.refresh()
+        return self.index.refresh()
+
+    def _on_refresh(self, future):
+        self._pending = None
+        try:
+            changed = future.result()
+        except Exception:
+            self.log.exception('Failed to refresh federated extensions')
+            return
+        if changed:
+            self.log.info('Federated extensions changed: %s',
+                          ', '.join(sorted(changed)))
+            self._update()
+
+    def _update(self):
+        """Update the page config and the version from the index."""
+        extensions, mime_extensions = get_load_data(self.index.extensions)
+        key = get_remote_entries_key(self.index.extensions)
+        page_config = self.page_config
+        page_config.setdefault('dynamic_extensions', [])[:] = extensions
+        page_config.setdefault('dynamic_mime_extensions', [])[:] = mime_extensions
+        if self.combine_remote_entries:
+            page_config['dynamic_remote_entries'] = (
+                'lab/remote-entries/%s.js' % key)
+        # The version is derived from the content, so that the processes
+        # serving the same extensions agree on it.
+        data = json.dumps([extensions, mime_extensions, key], sort_keys=True)
+        self.version = hashlib.sha256(data.encode('utf-8')).hexdigest()[:20]
+        page_config['dynamic_extensions_version'] = self.version
+
+
+def get_activation_triggers(ext_data):
+    """Get the lazy activation triggers declared by an extension, or None if
+    the extension is loaded eagerly.
+    """
+    declared = ext_data['jupyterlab'].get('activationTriggers')
+    if not isinstance(declared, dict):
+        return None
+    triggers = dict()
+    for key in ACTIVATION_TRIGGERS:
+        values = declared.get(key, [])
+        if isinstance(values, list):
+            values = [v for v in values if isinstance(v, str)]
+            if values:
+                triggers[key] = values
+    return triggers or None
+
+
+def get_load_data(extensions):
+    """Get the `dynamic_extensions` and `dynamic_mime_extensions` page config
+    data for a mapping of extension data.
+
+    An extension that declares activation triggers carries them as
+    `triggers`, and is only loaded when one of them fires.
+    """
+    dynamic_extensions = []
+    dynamic_mime_extensions = []
+    for (name, ext_data) in extensions.items():
+        path = "lab/extensions/%s/%s" % (name, REMOTE_ENTRY)
+        if ext_data.get('remote_entry_hash'):
+            # Versioned urls are served as immutable.
+            path += '?v=%s' % ext_data['remote_entry_hash']
+        module = "./extension"
+        load_data = dict(name=name, path=path, module=module)
+        triggers = get_activation_triggers(ext_data)
+        if triggers:
+            load_data['triggers'] = triggers
+        if ext_data['jupyterlab'].get('extension'):
+            dynamic_extensions.append(load_data)
+        else:
+            dynamic_mime_extensions.append(load_data)
+    return dynamic_extensions, dynamic_mime_extensions
+
+
+def get_combined_extensions(extensions):
+    """Get the extensions whose remote entries go into the combined remote
+    entries script: those that have a remote entry and are loaded eagerly.
+    """
+    return OrderedDict(
+        (name, ext_data) for (name, ext_data) in extensions.items()
+        if ext_data.get('remote_entry_hash')
+        and get_activation_triggers(ext_data) is None
+    )
+
+
+def get_remote_entries_key(extensions):
+    """Get a hash identifying the combined remote entries of a mapping of
+    extension data, used to version the combined remote entries script.
+    """
+    digest = hashlib.sha256()
+    for (name, ext_data) in get_combined_extensions(extensions).items():
+        line = '%s:%s\n' % (name, ext_data['remote_entry_hash'])
+        digest.update(line.encode('utf-8'))
+    return digest.hexdigest()[:20]
@@ -0,0 +1,484 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Generate synthetic federated extensions to test discovery and loading at
+scale.
+
+The extensions are written prebuilt, in the layout `jupyter labextension
+build` produces, so that a thousand of them can be generated in seconds.
+Each one is a module federation container with a small remote entry and an
+extension chunk, that consumes the core packages from the share scope.
+
+e.g. python generate.py 100 --mix plugin=6,mime=2,theme=1 --singletons 3
+     JUPYTER_PATH=build/synthetic python main.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import os.path as osp
+import random
+import shutil
+from string import Template
+import sys
+
+HERE = osp.abspath(osp.dirname(__file__))
+
+# The npm scope of the generated extensions.
+SCOPE = '@synthetic'
+
+# The kinds of extension that can be generated.
+KINDS = ('plugin', 'mime', 'theme')
+
+# The labextensions directory of a Jupyter data directory, so that it can be
+# added with `JUPYTER_PATH`.
+DEFAULT_OUTPUT = osp.join(HERE, 'build', 'synthetic', 'labextensions')
+
+# The container, which loads the extension chunk on `get` and resolves the
+# shared packages it needs from the share scope.  Shared singletons are
+# provided by the extension that defines them, like `middle_package`.
+REMOTE_ENTRY_TEMPLATE = Template('''\
+(function () {
+  var name = $name;
+  var chunk = $chunk;
+  var consumes = $consumes;
+  var provides = $provides;
+  var config = JSON.parse(
+    document.getElementById('jupyter-config-data').textContent
+  );
+  var publicPath = config.baseUrl + 'lab/extensions/' + name + '/';
+  var shareScope = null;
+  var loading = null;
+
+  function consume(pkg) {
+    var versions = shareScope[pkg];
+    if (!versions) {
+      return Promise.reject(new Error(name + ' could not consume ' + pkg));
+    }
+    var version = Object.keys(versions).sort().pop();
+    return Promise.resolve(versions[version].get()).then(function (factory) {
+      return factory();
+    });
+  }
+
+  function load() {
+    if (!loading) {
+      loading = new Promise(function (resolve, reject) {
+        var script = document.createElement('script');
+        script.onerror = reject;
+        script.onload = function () {
+          resolve(window._JUPYTERLAB_SYNTHETIC[name]);
+        };
+        script.src = publicPath + chunk;
+        document.head.appendChild(script);
+      });
+    }
+    return loading;
+  }
+
+  function provide(pkg) {
+    var module = null;
+    var versions = (shareScope[pkg] = shareScope[pkg] || {});
+    if (versions['1.0.0']) {
+      return;
+    }
+    versions['1.0.0'] = {
+      from: name,
+      eager: false,
+      get: function () {
+        if (!module) {
+          module = consume('@lumino/coreutils').then(function (coreutils) {
+            return { __esModule: true, IToken: new coreutils.Token(pkg) };
+          });
+        }
+        return module.then(function (value) {
+          return function () { return value; };
+        });
+      }
+    };
+  }
+
+  var container = {
+    init: function (scope) {
+      shareScope = scope;
+      provides.forEach(provide);
+    },
+    get: function (module) {
+      if (module !== './extension' && module !== './mimeExtension') {
+        return Promise.reject(new Error(name + ' has no module ' + module));
+      }
+      return load().then(function (define) {
+        return Promise.all(consumes.map(consume)).then(function (modules) {
+          var exports = define.apply(null, modules);
+          return function () { return exports; };
+        });
+      });
+    }
+  };
+
+  window._JUPYTERLAB = window._JUPYTERLAB || {};
+  window._JUPYTERLAB[name] = container;
+})();
+''')
+
+# The extension chunk, which defines the plugins given the consumed packages.
+CHUNK_TEMPLATE = Template('''\
+(window._JUPYTERLAB_SYNTHETIC = window._JUPYTERLAB_SYNTHETIC || {})[$name] =
+  function ($args) {
+    var name = $name;
+$body
+  };
+$padding''')
+
+PLUGIN_BODY = '''\
+    var tokens = Array.prototype.slice.call(arguments, $skip);
+    return {
+      __esModule: true,
+      default: {
+        id: name + ':plugin',
+        autoStart: true,
+        requires: tokens.map(function (mod) { return mod.IToken; })$settings_token,
+        provides: $provides,
+        activate: function (app) {
+          app.commands.addCommand(name + ':run', {
+            label: 'Run ' + name,
+            execute: function () { return name; }
+          });$load_settings
+          return name;
+        }
+      }
+    };'''
+
+SETTINGS_LOAD = '''
+          var registry = arguments[arguments.length - 1];
+          registry.load(name + ':plugin').catch(function (reason) {
+            console.error(reason);
+          });'''
+
+MIME_BODY = '''\
+    var mimeType = $mime_type;
+    return {
+      __esModule: true,
+      default: {
+        id: name + ':mime',
+        rendererFactory: {
+          safe: true,
+          mimeTypes: [mimeType],
+          createRenderer: function () {
+            var widget = new widgets.Widget();
+            widget.renderModel = function (model) {
+              widget.node.textContent = JSON.stringify(model.data[mimeType]);
+              return Promise.resolve();
+            };
+            return widget;
+          }
+        },
+        rank: 0,
+        dataType: 'json',
+        fileTypes: [{
+          name: name,
+          mimeTypes: [mimeType],
+          extensions: [$file_ext]
+        }],
+        documentWidgetFactoryOptions: {
+          name: name,
+          primaryFileType: name,
+          fileTypes: [name],
+          defaultFor: [name]
+        }
+      }
+    };'''
+
+THEME_BODY = '''\
+    return {
+      __esModule: true,
+      default: {
+        id: name + ':theme',
+        autoStart: true,
+        requires: [apputils.IThemeManager],
+        activate: function (app, manager) {
+          manager.register({
+            name: name,
+            isLight: true,
+            load: function () { return manager.loadCSS(name + '/index.css'); },
+            unload: function () { return Promise.resolve(undefined); }
+          });
+        }
+      }
+    };'''
+
+THEME_CSS = '''\
+:root {
+  --jp-brand-color1: %s;
+  --jp-layout-color1: %s;
+}
+'''
+
+SETTINGS_SCHEMA = dict(
+    title='Synthetic Extension',
+    description='Synthetic extension settings.',
+    properties=dict(
+        enabled=dict(
+            title='Enabled',
+            description='Whether the extension is enabled.',
+            type='boolean',
+            default=True
+        ),
+        size=dict(
+            title='Size',
+            description='A size.',
+            type='integer',
+            minimum=1,
+            maximum=100,
+            default=10
+        )
+    ),
+    additionalProperties=False,
+    type='object'
+)
+
+
+def parse_mix(value):
+    """Parse a `kind=weight,...` mix of extension kinds."""
+    mix = dict()
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError('Unknown extension kind %r' % kind)
+        mix[kind] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError('The extension mix is empty')
+    return mix
+
+
+def get_kinds(count, mix):
+    """Get the kinds of `count` extensions, in proportion to the mix."""
+    total = sum(mix.values())
+    kinds = []
+    for kind in KINDS:
+        kinds.extend([kind] * int(round(count * mix.get(kind, 0) / total)))
+    kinds = kinds[:count]
+    while len(kinds) < count:
+        kinds.append(max(mix, key=mix.get))
+    return kinds
+
+
+def _write(path, content):
+    os.makedirs(osp.dirname(path), exist_ok=True)
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    with open(path, mode) as fid:
+        fid.write(content)
+
+
+def write_extension(output, index, kind, rng, singletons=(), provides=None,
+                    settings=False, payload_size=0):
+    """Write a prebuilt synthetic extension.
+
+    Parameters
+    ----------
+    output: str
+        The labextensions directory to write to.
+    index: int
+        The index of the extension, used in its name.
+    kind: str
+        One of `KINDS`.
+    rng: random.Random
+        The random generator for the theme colors and the padding.
+    singletons: list of str, optional
+        The shared singleton packages the extension requires a token from.
+    provides: str, optional
+        The shared singleton package the extension provides the token of.
+    settings: bool, optional
+        Whether the extension has a settings schema.
+    payload_size: int, optional
+        The number of padding bytes in the extension chunk.
+
+    Returns
+    -------
+    The name of the extension.
+    """
+    name = '%s/extension-%04d' % (SCOPE, index)
+    ext_path = osp.join(output, *name.split('/'))
+    if osp.exists(ext_path):
+        shutil.rmtree(ext_path)
+    jname = json.dumps(name)
+
+    if kind == 'plugin':
+        consumes = ['@jupyterlab/settingregistry'] if settings else []
+        consumes += list(singletons)
+        if provides:
+            consumes.append(provides)
+        body = Template(PLUGIN_BODY).substitute(
+            skip=1 if settings else 0,
+            settings_token=(
+                '.concat([arguments[0].ISettingRegistry])' if settings else ''),
+            provides=('tokens[tokens.length - 1].IToken' if provides
+                      else 'undefined'),
+            load_settings=SETTINGS_LOAD if settings else ''
+        )
+        if provides:
+            # The provided token is not required.
+            body = body.replace(
+                'tokens.map(', 'tokens.slice(0, -1).map(')
+        args = ['settingregistry'] if settings else []
+    elif kind == 'mime':
+        consumes = ['@lumino/widgets']
+        body = Template(MIME_BODY).substitute(
+            mime_type=json.dumps(
+                'application/vnd.synthetic.extension-%04d+json' % index),
+            file_ext=json.dumps('.syn%04d' % index)
+        )
+        args = ['widgets']
+    else:
+        consumes = ['@jupyterlab/apputils']
+        body = THEME_BODY
+        args = ['apputils']
+        colors = ['#%06x' % rng.randrange(0x1000000) for _ in range(2)]
+        _write(osp.join(ext_path, 'themes', *name.split('/') + ['index.css']),
+               THEME_CSS % tuple(colors))
+
+    padding = ''
+    if payload_size:
+        # Incompressible padding, like minified code.
+        chars = 'abcdefghijklmnopqrstuvwxyz0123456789'
+        padding = '/* %s */\n' % ''.join(
+            rng.choice(chars) for _ in range(payload_size))
+    chunk = CHUNK_TEMPLATE.substitute(
+        name=jname, args=', '.join(args), body=body, padding=padding)
+    chunk_name = 'extension.%s.js' % hashlib.sha256(
+        chunk.encode('utf-8')).hexdigest()[:20]
+    _write(osp.join(ext_path, chunk_name), chunk)
+
+    _write(osp.join(ext_path, 'remoteEntry.js'), REMOTE_ENTRY_TEMPLATE.substitute(
+        name=jname,
+        chunk=json.dumps(chunk_name),
+        consumes=json.dumps(consumes),
+        provides=json.dumps([provides] if provides else [])
+    ))
+
+    if settings and kind == 'plugin':
+        _write(osp.join(ext_path, 'schemas', *name.split('/') + ['plugin.json']),
+               json.dumps(SETTINGS_SCHEMA, indent=2) + '\n')
+
+    module = './mimeExtension' if kind == 'mime' else './extension'
+    key = 'mimeExtension' if kind == 'mime' else 'extension'
+    jupyterlab = {
+        key: True,
+        '_build': {'load': 'remoteEntry.js', key: module}
+    }
+    if provides or singletons:
+        jupyterlab['singletonPackages'] = sorted(
+            set(singletons) | set([provides] if provides else []))
+    package = dict(
+        name=name,
+        version='1.0.0',
+        private=True,
+        jupyterlab=jupyterlab
+    )
+    _write(osp.join(ext_path, 'package.json'),
+           json.dumps(package, indent=2) + '\n')
+    return name
+
+
+def generate(output, count, mix=None, singletons=0, settings=0.5,
+             payload_size=0, seed=0):
+    """Generate synthetic extensions, replacing any generated before.
+
+    Parameters
+    ----------
+    output: str
+        The labextensions directory to write to.
+    count: int
+        The number of extensions.
+    mix: dict, optional
+        The relative weight of each kind of extension.
+    singletons: int, optional
+        The number of shared singleton packages, each provided by one
+        plugin and required by a random subset of the other plugins.
+    settings: float, optional
+        The fraction of plugins with a settings schema.
+    payload_size: int, optional
+        The number of padding bytes in each extension chunk.
+    seed: int, optional
+        The random seed, so that the output is reproducible.
+
+    Returns
+    -------
+    A dict mapping each extension name to its kind.
+    """
+    rng = random.Random(seed)
+    kinds = get_kinds(count, mix or dict(plugin=1))
+    rng.shuffle(kinds)
+
+    scope_path = osp.join(output, SCOPE)
+    if osp.exists(scope_path):
+        shutil.rmtree(scope_path)
+
+    plugins = [i for (i, kind) in enumerate(kinds) if kind == 'plugin']
+    shared = ['%s/shared-%d' % (SCOPE, i) for i in range(singletons)]
+    if len(shared) > len(plugins):
+        raise ValueError('Every shared singleton needs a plugin to provide it')
+    providers = dict(zip(plugins, shared))
+
+    generated = dict()
+    for (i, kind) in enumerate(kinds):
+        required = []
+        if kind == 'plugin' and i not in providers:
+            required = [s for s in shared if rng.random() < 0.5]
+        name = write_extension(
+            output, i, kind, rng,
+            singletons=required,
+            provides=providers.get(i),
+            settings=kind == 'plugin' and rng.random() < settings,
+            payload_size=payload_size
+        )
+        generated[name] = kind
+    return generated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('count', type=int, help='the number of extensions')
+    parser.add_argument(
+        '--output', default=DEFAULT_OUTPUT,
+        help='the labextensions directory to write to (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--mix', type=parse_mix, default=parse_mix('plugin=6,mime=2,theme=1'),
+        help='the relative weights of the kinds of extension, '
+             'e.g. plugin=6,mime=2,theme=1'
+    )
+    parser.add_argument(
+        '--singletons', type=int, default=0,
+        help='the number of shared singleton packages'
+    )
+    parser.add_argument(
+        '--settings', type=float, default=0.5,
+        help='the fraction of plugins with a settings schema'
+    )
+    parser.add_argument(
+        '--payload-size', type=int, default=0,
+        help='the number of padding bytes in each extension chunk'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    generated = generate(
+        args.output, args.count, mix=args.mix, singletons=args.singletons,
+        settings=args.settings, payload_size=args.payload_size, seed=args.seed
+    )
+    counts = dict()
+    for kind in generated.values():
+        counts[kind] = counts.get(kind, 0) + 1
+    print('Wrote %s extensions (%s) to %s' % (
+        len(generated),
+        ', '.join('%s %s' % (counts[k], k) for k in KINDS if k in counts),
+        args.output
+    ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
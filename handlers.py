@@ -0,0 +1,546 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Tornado handlers for the federated example app.
+"""
+from collections import OrderedDict
+import copy
+import gzip
+import hashlib
+import json
+import os
+import re
+import urllib.parse
+
+import json5
+from jsonschema import ValidationError
+from jupyter_server.utils import url_path_join as ujoin
+from jupyterlab_server.handlers import LabHandler
+from jupyterlab_server.server import APIHandler, JupyterHandler
+from jupyterlab_server.settings_handler import SettingsHandler
+from jupyterlab_server.themes_handler import ThemesHandler
+from jupyterlab_server.workspaces_handler import WorkspacesHandler, slugify
+from tornado import web
+
+from assets import accepted_encodings
+from discovery import (
+    REMOTE_ENTRY, get_combined_extensions, get_remote_entries_key
+)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from serviceworker import VERSION_HEADER
+from themes import THEME_STYLESHEET
+
+# Source maps are resolved relative to the script url, so they do not
+# survive concatenation.
+SOURCE_MAP_RE = re.compile(br'^//# sourceMappingURL=.*$', re.MULTILINE)
+
+# Run a combined remote entry as if it were loaded from its own url, which
+# an `auto` public path is derived from.
+CURRENT_SCRIPT_TEMPLATE = (
+    b"Object.defineProperty(document, 'currentScript', "
+    b"{configurable: true, value: {src: %s}});\n"
+)
+
+
+def htmlsafe_json_dumps(obj):
+    """Serialize an object to JSON that is safe to embed in a script tag.
+
+    This matches the output of the Jinja `tojson` filter.
+    """
+    return (json.dumps(obj, sort_keys=True)
+            .replace('<', '\\u003c')
+            .replace('>', '\\u003e')
+            .replace('&', '\\u0026')
+            .replace("'", '\\u0027'))
+
+
+def get_preload_urls(page_config, base_url):
+    """Get the urls of the scripts the page loads: the core bundle and the
+    remote entry of every dynamic extension that is not loaded lazily.
+    """
+    urls = [page_config['fullStaticUrl'] + '/bundle.js']
+    if page_config.get('dynamic_remote_entries'):
+        urls.append(ujoin(base_url, page_config['dynamic_remote_entries']))
+        return urls
+    for key in ('dynamic_extensions', 'dynamic_mime_extensions'):
+        for data in page_config.get(key, []):
+            if data.get('triggers'):
+                continue
+            urls.append(ujoin(base_url, data['path']))
+    return urls
+
+
+class PageCache(object):
+    """A cache of the rendered index page.
+
+    The page config is only serialized again when it actually changes.  The
+    keys in `volatile_keys` differ between requests, so they are serialized
+    separately and appended to the cached serialization.  Rendered pages are
+    kept in a small LRU cache along with their ETag.
+
+    The `store_id` counter that `LabHandler` bumps on every request is not
+    read by the frontend, and is left out so that the page can be cached.
+    """
+
+    volatile_keys = ('treePath', 'workspace', 'mode')
+    ignored_keys = ('store_id',)
+    max_pages = 64
+
+    def __init__(self):
+        self.revision = 0
+        self._snapshot = None
+        self._config_json = None
+        self._pages = OrderedDict()
+
+    def get(self, page_config, render):
+        """Get the body and ETag of the page for a page config.
+
+        Parameters
+        ----------
+        page_config: dict
+            The full page config for the request.
+        render: callable
+            Renders the page given the serialized page config.
+
+        Returns
+        -------
+        A (body, etag) tuple where the body is bytes.
+        """
+        stable = dict()
+        volatile = dict()
+        for (key, value) in page_config.items():
+            if key in self.ignored_keys:
+                continue
+            if key in self.volatile_keys:
+                volatile[key] = value
+            else:
+                stable[key] = value
+
+        if stable != self._snapshot:
+            self._snapshot = copy.deepcopy(stable)
+            self._config_json = htmlsafe_json_dumps(stable)
+            self.revision += 1
+            self._pages.clear()
+
+        config_json = self._config_json
+        volatile_json = htmlsafe_json_dumps(volatile) if volatile else ''
+        key = (self.revision, volatile_json)
+        if key in self._pages:
+            self._pages.move_to_end(key)
+            return self._pages[key]
+
+        if volatile_json:
+            sep = ', ' if stable else ''
+            config_json = config_json[:-1] + sep + volatile_json[1:]
+        body = render(config_json)
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self._pages[key] = (body, etag)
+        if len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return body, etag
+
+
+class LabPageHandler(LabHandler):
+    """The lab page handler, serving the index page from a `PageCache`.
+
+    The page carries a strong ETag, so reloads get a 304 Not Modified
+    until the page config changes.  The scripts the page loads are also
+    announced as preload `Link` headers, so the browser can fetch every
+    remote entry in parallel with the core bundle.
+    """
+
+    # Proxies commonly limit the total size of the response headers.
+    max_link_header = 4096
+
+    _page_etag = None
+
+    def render_template(self, name, **ns):
+        lab_metrics = self.settings.get('lab_metrics')
+        cache = self.settings.get('page_cache')
+        if name != 'index.html' or cache is None:
+            if lab_metrics is None:
+                return super().render_template(name, **ns)
+            with lab_metrics.template_render_seconds.time(template=name):
+                return super().render_template(name, **ns)
+
+        page_config = dict(ns.pop('page_config'))
+        page_config.update(
+            baseUrl=self.base_url,
+            wsUrl=self.settings.get('websocket_url', '')
+        )
+
+        preload_urls = get_preload_urls(page_config, self.base_url)
+
+        rendered = []
+
+        def render(config_json):
+            rendered.append(name)
+            if lab_metrics is None:
+                return self._render(name, page_config, config_json,
+                                    preload_urls, ns)
+            with lab_metrics.template_render_seconds.time(template=name):
+                return self._render(name, page_config, config_json,
+                                    preload_urls, ns)
+
+        body, self._page_etag = cache.get(page_config, render)
+        if lab_metrics is not None:
+            lab_metrics.page_cache_total.inc(
+                result='miss' if rendered else 'hit')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_link_header(preload_urls)
+        service_worker = self.settings.get('service_worker')
+        if service_worker is not None:
+            self.set_header(VERSION_HEADER, service_worker.get()[0])
+        return body
+
+    def _render(self, name, page_config, config_json, preload_urls, ns):
+        return super().render_template(
+            name, page_config=page_config, page_config_json=config_json,
+            preload_urls=preload_urls, **ns
+        )
+
+    def set_link_header(self, urls):
+        """Set the preload Link header for as many urls as fit."""
+        links = []
+        size = 0
+        for url in urls:
+            link = '<%s>; rel=preload; as=script' % url
+            size += len(link) + 2
+            if size > self.max_link_header:
+                break
+            links.append(link)
+        if links:
+            self.set_header('Link', ', '.join(links))
+
+    def compute_etag(self):
+        if self._page_etag is not None:
+            return self._page_etag
+        return super().compute_etag()
+
+
+class ExtensionsVersionHandler(APIHandler):
+    """Report the version of the federated extension list, which is a hash
+    of the extension data, so it changes whenever an extension is installed,
+    removed or changed on disk.
+    """
+
+    def initialize(self, watcher):
+        self.watcher = watcher
+
+    @web.authenticated
+    def get(self):
+        self.set_header('Cache-Control', 'no-cache')
+        self.finish(json.dumps(dict(version=self.watcher.version)))
+
+
+class MetricsHandler(APIHandler):
+    """Serve the app metrics in the Prometheus text format."""
+
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    @web.authenticated
+    def get(self):
+        self.set_header('Content-Type', METRICS_CONTENT_TYPE)
+        self.set_header('Cache-Control', 'no-cache')
+        self.finish(self.metrics.render())
+
+
+class CachedSettingsHandler(SettingsHandler):
+    """Serve the plugin settings from a `SettingsCache`.
+
+    The listing of every plugin's settings is served with an ETag computed
+    from the stat signatures of the settings files, so the client can fetch
+    all of them in one request, and reloads get a 304 Not Modified until a
+    file changes.  Writes are validated with the cached validator of the
+    schema, and only the changed keys are validated when possible.
+    """
+
+    def initialize(self, name, cache, labextensions_path):
+        super(SettingsHandler, self).initialize(name)
+        self.cache = cache
+        self.overrides = cache.overrides
+        self.app_settings_dir = cache.app_settings_dir
+        self.schemas_dir = cache.schemas_dir
+        self.settings_dir = cache.settings_dir
+        self.labextensions_path = labextensions_path
+
+    @web.authenticated
+    def get(self, schema_name=''):
+        self.set_header('Cache-Control', 'no-cache')
+        if not schema_name:
+            body, etag, warnings = self.cache.get_batch()
+            for warning in warnings:
+                self.log.warning(warning)
+            self.set_header('Etag', etag)
+            if self.check_etag_header():
+                self.set_status(304)
+                return
+            self.set_header('Content-Type', 'application/json')
+            return self.finish(body)
+
+        plugin, warning = self.cache.get(schema_name)
+        if plugin is None:
+            return super().get(schema_name)
+        if warning:
+            self.log.warning(warning)
+        return self.finish(json.dumps(plugin))
+
+    @web.authenticated
+    def put(self, schema_name):
+        if not self.settings_dir:
+            raise web.HTTPError(500, 'No current settings directory')
+
+        raw_payload = self.request.body.strip().decode('utf-8')
+        try:
+            raw_settings = json.loads(raw_payload)['raw']
+            payload = json5.loads(raw_settings)
+        except (KeyError, TypeError):
+            raise web.HTTPError(400, 'Invalid format for JSON payload. Must '
+                                     'be in the form {\'raw\': ...}')
+        except ValueError as e:
+            raise web.HTTPError(400, 'Failed parsing JSON payload: %s' % e)
+
+        # Validate the data against the cached validator of the schema.
+        try:
+            found = self.cache.validate(schema_name, payload)
+        except ValidationError as e:
+            raise web.HTTPError(400, 'Failed validating input: %s' % e)
+        if not found:
+            return super().put(schema_name)
+
+        # Write the raw data (comments included) to a file.
+        self.cache.write(schema_name, raw_settings, payload)
+        self.set_status(204)
+
+
+class WorkspaceStoreHandler(WorkspacesHandler):
+    """Serve the lab workspaces from a `WorkspaceStore`, so a save only
+    appends the changes to the workspace and reads come from memory.
+    """
+
+    def initialize(self, name, path, store, **kwargs):
+        super().initialize(name, path, **kwargs)
+        self.store = store
+
+    @web.authenticated
+    def delete(self, space_name):
+        self.ensure_directory()
+        if not space_name:
+            raise web.HTTPError(400, 'Workspace name is required for DELETE')
+
+        slug = slugify(space_name)
+        if not self.store.delete(slug):
+            raise web.HTTPError(404, 'Workspace %r (%r) not found' %
+                                     (space_name, slug))
+        self.set_status(204)
+
+    @web.authenticated
+    def get(self, space_name=''):
+        self.ensure_directory()
+
+        if not space_name:
+            workspaces = self.store.list(slugify('', sign=False))
+            return self.finish(json.dumps(dict(workspaces=workspaces)))
+
+        try:
+            workspace = self.store.get(slugify(space_name))
+        except Exception as e:
+            raise web.HTTPError(500, str(e))
+        if workspace is None:
+            id = space_name if space_name.startswith('/') else '/' + space_name
+            workspace = dict(data=dict(), metadata=dict(id=id))
+        return self.finish(json.dumps(workspace))
+
+    @web.authenticated
+    def put(self, space_name=''):
+        if not space_name:
+            raise web.HTTPError(400, 'Workspace name is required for PUT.')
+        self.ensure_directory()
+
+        try:
+            workspace = json.loads(self.request.body.strip().decode('utf-8'))
+            metadata_id = workspace['metadata']['id']
+        except Exception as e:
+            raise web.HTTPError(400, str(e))
+
+        # Make sure metadata ID matches the workspace name.
+        # Transparently support an optional inital root `/`.
+        if not metadata_id.startswith('/'):
+            metadata_id = '/' + metadata_id
+        metadata_id = urllib.parse.unquote(metadata_id)
+        if metadata_id != '/' + space_name:
+            raise web.HTTPError(400, 'Workspace metadata ID mismatch: '
+                                     'expected %r got %r'
+                                     % (space_name, metadata_id))
+
+        try:
+            self.store.save(slugify(space_name), workspace)
+        except OSError as e:
+            raise web.HTTPError(500, str(e))
+        self.set_status(204)
+
+
+class ThemeBundlesHandler(JupyterHandler):
+    """Serve the precompiled theme bundles from memory.
+
+    The listing has the url of the rules stylesheet and the custom property
+    map of every theme.  The stylesheets of rules are named by their
+    content hash, so they are served as immutable.
+    """
+
+    def initialize(self, bundles):
+        self.bundles = bundles
+
+    def get(self, filename=''):
+        if not filename:
+            data = dict()
+            for (key, bundle) in self.bundles.get_bundles().items():
+                data[key] = dict(
+                    url=ujoin(self.bundles.bundles_url, bundle['filename']),
+                    variables=bundle['variables']
+                )
+            self.set_header('Cache-Control', 'no-cache')
+            return self.finish(json.dumps(data, sort_keys=True))
+
+        bundle = self.bundles.get_rules(filename)
+        if bundle is None:
+            raise web.HTTPError(404)
+        body = bundle['css']
+        self.set_header('Content-Type', 'text/css; charset=UTF-8')
+        self.set_header('Cache-Control', 'public, max-age=%d, immutable'
+                        % web.StaticFileHandler.CACHE_MAX_AGE)
+        self.set_header('Vary', 'Accept-Encoding')
+        accepted = accepted_encodings(self.request.headers.get('Accept-Encoding'))
+        if 'gzip' in accepted:
+            self.set_header('Content-Encoding', 'gzip')
+            body = bundle['css_gzip']
+        self.finish(body)
+
+    def compute_etag(self):
+        if self.path_args:
+            return '"%s"' % self.path_args[0]
+        return super().compute_etag()
+
+
+class BundledThemesHandler(ThemesHandler):
+    """Serve the stylesheet of a bundled theme as its custom properties and
+    an import of its rules, and everything else as the themes handler does.
+
+    The theme manager loads the theme stylesheets, so the themes with the
+    same rules share their imported stylesheet and switching between them
+    only fetches the custom properties.
+    """
+
+    def initialize(self, path, bundles, **kwargs):
+        super().initialize(path, **kwargs)
+        self.bundles = bundles
+
+    async def get(self, path, include_body=True):
+        name, _, filename = path.rpartition('/')
+        bundle = None
+        if filename == THEME_STYLESHEET:
+            bundle = self.bundles.get_bundles().get(name)
+        if bundle is None:
+            return await super().get(path, include_body=include_body)
+
+        body = bundle['stylesheet']
+        self.set_header('Content-Type', 'text/css; charset=UTF-8')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('Etag', '"%s"' % hashlib.sha1(body).hexdigest())
+        if self.check_etag_header():
+            self.set_status(304)
+            return self.finish()
+        self.finish(body if include_body else None)
+
+
+class ServiceWorkerHandler(JupyterHandler):
+    """Serve the service worker script that precaches the assets.
+
+    The script is always revalidated, since the browser checks it for
+    updates.  It is allowed to control the lab pages, which are outside of
+    its directory.
+    """
+
+    _version = None
+
+    def initialize(self, service_worker, scope):
+        self.service_worker = service_worker
+        self.scope = scope
+
+    def get(self):
+        self._version, script = self.service_worker.get()
+        self.set_header('Content-Type', 'application/javascript; charset=UTF-8')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('Service-Worker-Allowed', self.scope)
+        self.finish(script)
+
+    def compute_etag(self):
+        if self._version is None:
+            return super().compute_etag()
+        return '"%s"' % self._version
+
+
+class RemoteEntriesHandler(JupyterHandler):
+    """Serve the remote entries of the eagerly loaded federated extensions
+    as a single script, so the page needs one request instead of one per
+    extension.
+
+    The script is keyed by the hash of the set of remote entries, so it is
+    served as immutable.  Only the script of the current key is kept in
+    memory, along with its gzipped form.
+
+    A remote entry built with the default `auto` public path loads its
+    chunks relative to the url of its script, so each one runs with
+    `document.currentScript` pointing at its own url.
+    """
+
+    # (key, body, gzipped body) of the current script.
+    _cache = None
+
+    def initialize(self, index):
+        self.index = index
+
+    def get(self, key):
+        extensions = self.index.extensions
+        if key != get_remote_entries_key(extensions):
+            raise web.HTTPError(404)
+
+        cache = RemoteEntriesHandler._cache
+        if cache is None or cache[0] != key:
+            body = self._build(get_combined_extensions(extensions))
+            cache = RemoteEntriesHandler._cache = (
+                key, body, gzip.compress(body))
+        body, gzipped = cache[1:]
+
+        self.set_header('Content-Type', 'application/javascript; charset=UTF-8')
+        self.set_header('Cache-Control', 'public, max-age=%d, immutable'
+                        % web.StaticFileHandler.CACHE_MAX_AGE)
+        self.set_header('Vary', 'Accept-Encoding')
+        accepted = accepted_encodings(self.request.headers.get('Accept-Encoding'))
+        if 'gzip' in accepted:
+            self.set_header('Content-Encoding', 'gzip')
+            body = gzipped
+        self.finish(body)
+
+    def compute_etag(self):
+        return '"%s"' % self.path_args[0]
+
+    def _build(self, extensions):
+        """Concatenate the remote entries of the extensions."""
+        parts = []
+        for (name, ext_data) in extensions.items():
+            path = os.path.join(ext_data['ext_path'], REMOTE_ENTRY)
+            with open(path, 'rb') as fid:
+                source = fid.read()
+            url = ujoin(self.base_url, 'lab', 'extensions', name, REMOTE_ENTRY)
+            # The declarations of the entry must stay global, so it is
+            # wrapped in a block rather than a function.
+            parts.append(b'/* ' + name.encode('utf-8') + b' */\ntry {\n')
+            parts.append(CURRENT_SCRIPT_TEMPLATE % json.dumps(url).encode('utf-8'))
+            parts.append(SOURCE_MAP_RE.sub(b'', source))
+            parts.append(b'\n} finally {\ndelete document.currentScript;\n}\n')
+        return b''.join(parts)
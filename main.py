@@ -3,16 +3,31 @@
 
 from jupyter_core.paths import jupyter_path
 from jupyterlab_server import LabServerApp, LabConfig
+from jupyterlab_server.handlers import LabHandler
 from jupyterlab_server.server import FileFindHandler, APIHandler
 
 from jupyter_server.utils import url_path_join as ujoin, url_escape
 import json
 import os
-from traitlets import Unicode, List, Bool
+from traitlets import Unicode, List, Bool, Float, Integer
 
 from tornado.web import StaticFileHandler
 
-from jupyterlab.commands import get_app_info
+from assets import (
+    AssetCache, FileIndex, LabExtensionHandler, StaticAssetHandler
+)
+from discovery import ExtensionIndex, ExtensionWatcher
+from handlers import (
+    BundledThemesHandler, CachedSettingsHandler, ExtensionsVersionHandler,
+    LabPageHandler, MetricsHandler, PageCache, RemoteEntriesHandler,
+    ServiceWorkerHandler, ThemeBundlesHandler, WorkspaceStoreHandler
+)
+from metrics import LabMetrics
+from prefork import PreforkServerApp
+from serviceworker import ServiceWorker
+from settings import SettingsCache
+from themes import ThemeBundles
+from workspaces import WorkspaceStore
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 
@@ -48,7 +63,87 @@ class ExampleApp(LabServerApp):
     user_settings_dir = os.path.join(HERE, 'core_package', 'static', 'user_settings')
     workspaces_dir = os.path.join(HERE, 'core_package', 'static', 'workspaces')
 
+    extension_index_path = Unicode(
+        os.path.join(HERE, 'build', 'labextensions_index.json'), config=True,
+        help='The file used to persist the federated extension index between '
+             'server starts.  Set to an empty string to disable persistence.'
+    )
+
+    extension_poll_interval = Float(2.0, config=True,
+        help='The interval in seconds at which the labextensions paths are '
+             'polled for changed extensions.  Set to 0 to disable polling.'
+    )
+
+    append_only_workspaces = Bool(False, config=True,
+        help='Save each workspace change as a patch appended to a log next '
+             'to the workspace file, which is compacted in the background, '
+             'and serve the workspaces from memory.'
+    )
+
+    combine_remote_entries = Bool(False, config=True,
+        help='Load the remote entries of the eagerly loaded federated '
+             'extensions as a single script.  The extensions with activation '
+             'triggers are still loaded on their own when needed.'
+    )
+
+    asset_cache_size = Integer(64 * 1024 * 1024, config=True,
+        help='The number of bytes of labextension and static assets to keep '
+             'in memory, with the least recently used evicted first.  Set to '
+             '0 to disable the cache.'
+    )
+
+    service_worker = Bool(False, config=True,
+        help='Register a service worker that precaches the assets listed in '
+             'the asset manifests of the core bundle and of the federated '
+             'extensions, and serves them without a request until they '
+             'change.'
+    )
+
+    workers = Integer(1, config=True,
+        help='The number of worker processes that serve the app from a shared '
+             'listening socket.  The extensions are discovered once before '
+             'the workers are forked.  Each worker has its own caches and '
+             'metrics, and the kernels, sessions and terminals are disabled, '
+             'so this is meant for serving the frontend.'
+    )
+
+    @classmethod
+    def _get_workers(cls, argv):
+        """Get the number of workers from the command line, which picks the
+        server class before the config is loaded."""
+        flag = '--%s.workers' % cls.__name__
+        workers = cls.workers.default_value
+        for (i, arg) in enumerate(argv):
+            if arg.startswith(flag + '='):
+                value = arg[len(flag) + 1:]
+            elif arg == flag and i + 1 < len(argv):
+                value = argv[i + 1]
+            else:
+                continue
+            try:
+                workers = cls.workers.from_string(value)
+            except ValueError:
+                pass
+        return workers
+
+    @classmethod
+    def initialize_server(cls, argv=None, load_other_extensions=True, **kwargs):
+        if cls._get_workers(argv or []) > 1 and hasattr(os, 'fork'):
+            # Create the server instance that the stock method then uses.
+            jpserver_extensions = {cls.get_extension_package(): True}
+            jpserver_extensions.update(
+                cls.serverapp_config.get('jpserver_extensions', {}))
+            PreforkServerApp.instance(
+                jpserver_extensions=jpserver_extensions, **kwargs)
+        return super().initialize_server(
+            argv=argv, load_other_extensions=load_other_extensions, **kwargs)
+
     def initialize_handlers(self):
+        self.metrics = LabMetrics()
+        with self.metrics.initialize_handlers_seconds.time():
+            self._initialize_handlers()
+
+    def _initialize_handlers(self):
         # Handle labextension assets
         web_app = self.serverapp.web_app
         base_url = web_app.settings['base_url']
@@ -61,20 +156,167 @@ class ExampleApp(LabServerApp):
         if self.browser_test:
             page_config['browserTest'] = True
 
-        info = get_app_info()
-        dynamic_extensions = page_config['dynamic_extensions'] = []
-        dynamic_mime_extension = page_config['dynamic_mime_extensions'] = []
-        for (ext, ext_data) in info['dynamic_exts'].items():
-            name = ext_data['name']
-            path = "lab/extensions/%s/remoteEntry.js" % name
-            module = "./extension"
-            load_data = dict(name=name, path=path, module=module)
-            if ext_data['jupyterlab'].get('extension'):
-                dynamic_extensions.append(load_data)
-            else:
-                dynamic_mime_extension.append(load_data)
+        web_app.settings['page_cache'] = PageCache()
+        if self.asset_cache_size > 0:
+            web_app.settings['asset_cache'] = AssetCache(self.asset_cache_size)
+
+        # Record the latency and size of every response.
+        web_app.settings['lab_metrics'] = self.metrics
+        web_app.settings['log_function'] = self.metrics.wrap_log_function(
+            web_app.settings.get('log_function'))
+
+        labextensions_path = self.extra_labextensions_path + self.labextensions_path
+        index = ExtensionIndex(labextensions_path,
+                               index_path=self.extension_index_path,
+                               log=self.log, metrics=self.metrics)
+        index.refresh()
+        # Resolve the served files without searching the paths.
+        labextensions_files = FileIndex(labextensions_path, log=self.log)
+        static_files = FileIndex(self.static_paths, log=self.log)
+        self.extension_watcher = ExtensionWatcher(
+            index, page_config, interval=self.extension_poll_interval,
+            combine_remote_entries=self.combine_remote_entries,
+            file_indexes=[labextensions_files, static_files], log=self.log
+        )
+        worker_callbacks = []
+        if self.extension_poll_interval > 0:
+            worker_callbacks.append(self.extension_watcher.start)
+
+        prefork = (self.workers > 1 and
+                   isinstance(self.serverapp, PreforkServerApp))
+        if prefork:
+            # Anything running on the event loop starts in the workers.
+            self.serverapp.prefork(self.workers, worker_callbacks)
+            worker_callbacks = []
+        elif self.workers > 1:
+            self.log.warning('The server cannot pre-fork workers, serving '
+                             'from a single process')
+        for callback in worker_callbacks:
+            callback()
+
+        self.handlers.append((
+            ujoin('lab', 'api', 'federated-extensions'),
+            ExtensionsVersionHandler,
+            {'watcher': self.extension_watcher}
+        ))
+        self.handlers.append((
+            ujoin('lab', 'api', 'metrics'),
+            MetricsHandler,
+            {'metrics': self.metrics}
+        ))
+        # Take precedence over the default settings handlers.
+        settings_config = {
+            'cache': SettingsCache(
+                self.app_settings_dir, self.schemas_dir,
+                self.user_settings_dir, index=index, log=self.log
+            ),
+            'labextensions_path': labextensions_path
+        }
+        self.handlers.append((
+            ujoin(self.settings_url, '?'),
+            CachedSettingsHandler,
+            settings_config
+        ))
+        self.handlers.append((
+            ujoin(self.settings_url, '(?P<schema_name>.+)'),
+            CachedSettingsHandler,
+            settings_config
+        ))
+        if self.append_only_workspaces and prefork:
+            self.log.warning('Append-only workspaces are served from memory, '
+                             'which the workers do not share, using the '
+                             'default workspaces handlers')
+        if not self.append_only_workspaces or prefork:
+            # The default handlers ignore the logs of the append-only store,
+            # so any left by a previous run are folded into the snapshots.
+            WorkspaceStore(self.workspaces_dir, log=self.log).compact_all()
+        else:
+            # Take precedence over the default workspaces handlers.
+            workspaces_config = {
+                'path': self.workspaces_dir,
+                'store': WorkspaceStore(self.workspaces_dir, log=self.log)
+            }
+            self.handlers.append((
+                ujoin(self.workspaces_api_url, '?'),
+                WorkspaceStoreHandler,
+                workspaces_config
+            ))
+            self.handlers.append((
+                ujoin(self.workspaces_api_url, '(?P<space_name>.+)'),
+                WorkspaceStoreHandler,
+                workspaces_config
+            ))
+        theme_bundles = ThemeBundles(
+            self.themes_dir, ujoin(base_url, self.themes_url),
+            ujoin(base_url, 'lab', 'api', 'theme-bundles'), index=index,
+            log=self.log
+        )
+        self.handlers.append((
+            ujoin('lab', 'api', 'theme-bundles'),
+            ThemeBundlesHandler,
+            {'bundles': theme_bundles}
+        ))
+        self.handlers.append((
+            ujoin('lab', 'api', 'theme-bundles', r'(bundle\.[a-f0-9]+\.css)'),
+            ThemeBundlesHandler,
+            {'bundles': theme_bundles}
+        ))
+        # Take precedence over the default themes handler.
+        self.handlers.append((
+            ujoin(self.themes_url, '(.*)'),
+            BundledThemesHandler,
+            {
+                'path': self.themes_dir,
+                'bundles': theme_bundles,
+                'themes_url': self.themes_url,
+                'labextensions_path': labextensions_path,
+                'no_cache_paths': [] if self.cache_files else ['/']
+            }
+        ))
+        if self.service_worker:
+            web_app.settings['service_worker'] = ServiceWorker(
+                self.static_dir, ujoin(base_url, 'static', self.name),
+                ujoin(base_url, 'lab', 'extensions'), index=index,
+                log=self.log
+            )
+            page_config['serviceWorkerUrl'] = 'lab/service-worker.js'
+            self.handlers.append((
+                ujoin('lab', 'service-worker.js'),
+                ServiceWorkerHandler,
+                {
+                    'service_worker': web_app.settings['service_worker'],
+                    'scope': ujoin(base_url, 'lab')
+                }
+            ))
+        self.handlers.append((
+            ujoin('lab', 'remote-entries', r'([a-f0-9]+)\.js'),
+            RemoteEntriesHandler,
+            {'index': index}
+        ))
+        # Take precedence over the default labextensions handler.
+        self.handlers.append((
+            ujoin('lab', 'extensions', '(.*)'),
+            LabExtensionHandler,
+            {
+                'path': labextensions_path,
+                'index': index,
+                'file_index': labextensions_files,
+                'no_cache_paths': [] if self.cache_files else ['/']
+            }
+        ))
+        self.handlers.append((
+            ujoin('static', self.name, '(.*)'),
+            StaticAssetHandler,
+            {'path': self.static_paths, 'file_index': static_files}
+        ))
         super().initialize_handlers()
 
+        # Serve the index page from the page cache.
+        self.handlers = [
+            (h[0], LabPageHandler) + tuple(h[2:]) if h[1] is LabHandler else h
+            for h in self.handlers
+        ]
+
 
 if __name__ == '__main__':
     ExampleApp.launch_instance()
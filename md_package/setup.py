@@ -48,8 +48,17 @@ cmdclass = create_cmdclass("jsdeps",
     data_files_spec=data_files_spec
 )
 
+# The files the build reads, so it is skipped when they are unchanged
+js_sources = [
+    pjoin(HERE, "src"),
+    pjoin(HERE, "style"),
+    pjoin(HERE, "schema"),
+    pjoin(HERE, "tsconfig.json"),
+]
+
 cmdclass["jsdeps"] = combine_commands(
-    install_npm(HERE, build_cmd="build:all", npm=["jlpm"]),
+    install_npm(HERE, build_cmd="build:all", npm=["jlpm"],
+                build_dir=lab_path, source_dir=js_sources),
     ensure_targets(jstargets),
 )
 
@@ -11,7 +11,9 @@ within a Python package.
 """
 from collections import defaultdict
 from os.path import join as pjoin
+import hashlib
 import io
+import json
 import os
 import functools
 import pipes
@@ -214,14 +216,140 @@ def run(cmd, **kwargs):
     return subprocess.check_call(cmd, **kwargs)
 
 
-def is_stale(target, source):
+class BuildManifest(object):
+    """A persistent record of the inputs and outputs of build steps.
+
+    Files are recorded with their size, mtime and content digest, and a file
+    is only hashed again when its size or mtime changes.  A step is stale when
+    the contents of its sources differ from the last recorded run, or when an
+    output it wrote is missing or changed.  Touching a file (e.g. by a
+    checkout) does not cause a rebuild.
+
+    Parameters
+    ----------
+    path: str
+        The file used to persist the manifest.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        # Absolute file path -> [size, mtime_ns, digest].
+        self._files = {}
+        # Step name -> dict of sources and targets digests.
+        self._steps = {}
+        try:
+            with open(path) as fid:
+                data = json.load(fid)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.version:
+            self._files = data['files']
+            self._steps = data['steps']
+
+    def digest(self, paths):
+        """Get a digest of the contents of a set of files and directories.
+
+        Directories are walked recursively, skipping `node_modules`.
+        """
+        digest = hashlib.sha256()
+        for path in sorted(os.path.abspath(p) for p in paths):
+            if not os.path.exists(path):
+                digest.update(('%s\0missing\n' % path).encode('utf-8'))
+                continue
+            for fpath in self._iter_files(path):
+                line = '%s\0%s\n' % (fpath, self._file_digest(fpath))
+                digest.update(line.encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_stale(self, step, sources, targets):
+        """Test whether a build step needs to run.
+
+        Files added to the targets since the step ran (e.g. precompressed
+        copies of the outputs) do not make it stale.
+
+        Parameters
+        ----------
+        step: str
+            The name of the step.
+        sources: list of str
+            The files and directories the step reads.
+        targets: list of str
+            The files and directories the step writes.
+        """
+        if not all(os.path.exists(t) for t in targets):
+            return True
+        recorded = self._steps.get(step)
+        if recorded is None or recorded['sources'] != self.digest(sources):
+            return True
+        for (fpath, digest) in recorded['targets'].items():
+            try:
+                if self._file_digest(fpath) != digest:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def record(self, step, sources, targets, hash_targets=True):
+        """Record a successful run of a build step and save the manifest.
+
+        If `hash_targets` is False, only the existence of the targets is
+        checked by `is_stale`.
+        """
+        outputs = dict()
+        if hash_targets:
+            for target in targets:
+                for fpath in self._iter_files(os.path.abspath(target)):
+                    outputs[fpath] = self._file_digest(fpath)
+        self._steps[step] = dict(sources=self.digest(sources), targets=outputs)
+        self.save()
+
+    def save(self):
+        """Atomically persist the manifest."""
+        data = dict(version=self.version, files=self._files, steps=self._steps)
+        tmp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w') as fid:
+                json.dump(data, fid)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warn('Could not write build manifest %s: %s' % (self.path, e))
+
+    def _iter_files(self, path):
+        if not os.path.isdir(path):
+            yield path
+            return
+        for (root, dirnames, filenames) in os.walk(path):
+            if 'node_modules' in dirnames:
+                dirnames.remove('node_modules')
+            dirnames.sort()
+            for filename in sorted(filenames):
+                yield pjoin(root, filename)
+
+    def _file_digest(self, path):
+        st = os.stat(path)
+        cached = self._files.get(path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as fid:
+            for chunk in iter(lambda: fid.read(65536), b''):
+                digest.update(chunk)
+        self._files[path] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+        return self._files[path][2]
+
+
+def is_stale(target, source, manifest):
     """Test whether the target file/directory is stale based on the source
-       file/directory.
+       file/directory, as recorded by a build manifest.
+
+    Call `manifest.record('stale:' + target, [source], [target])` after
+    updating the target.
     """
-    if not os.path.exists(target):
-        return True
-    target_mtime = recursive_mtime(target) or 0
-    return compare_recursive_mtime(source, cutoff=target_mtime)
+    sources = source if isinstance(source, (list, tuple)) else [source]
+    return manifest.is_stale('stale:' + target, sources, [target])
 
 
 class BaseCommand(Command):
@@ -264,53 +392,6 @@ def combine_commands(*commands):
     return CombinedCommand
 
 
-def compare_recursive_mtime(path, cutoff, newest=True):
-    """Compare the newest/oldest mtime for all files in a directory.
-
-    Cutoff should be another mtime to be compared against. If an mtime that is
-    newer/older than the cutoff is found it will return True.
-    E.g. if newest=True, and a file in path is newer than the cutoff, it will
-    return True.
-    """
-    if os.path.isfile(path):
-        mt = mtime(path)
-        if newest:
-            if mt > cutoff:
-                return True
-        elif mt < cutoff:
-            return True
-    for dirname, _, filenames in os.walk(path, topdown=False):
-        for filename in filenames:
-            mt = mtime(pjoin(dirname, filename))
-            if newest:  # Put outside of loop?
-                if mt > cutoff:
-                    return True
-            elif mt < cutoff:
-                return True
-    return False
-
-
-def recursive_mtime(path, newest=True):
-    """Gets the newest/oldest mtime for all files in a directory."""
-    if os.path.isfile(path):
-        return mtime(path)
-    current_extreme = None
-    for dirname, dirnames, filenames in os.walk(path, topdown=False):
-        for filename in filenames:
-            mt = mtime(pjoin(dirname, filename))
-            if newest:  # Put outside of loop?
-                if mt >= (current_extreme or mt):
-                    current_extreme = mt
-            elif mt <= (current_extreme or mt):
-                current_extreme = mt
-    return current_extreme
-
-
-def mtime(path):
-    """shorthand for mtime"""
-    return os.stat(path).st_mtime
-
-
 def install_npm(path=None, build_dir=None, source_dir=None, build_cmd='build',
                 force=False, npm=None):
     """Return a Command for managing an npm installation.
@@ -324,12 +405,17 @@ def install_npm(path=None, build_dir=None, source_dir=None, build_cmd='build',
     build_dir: str, optional
         The target build directory.  If this and source_dir are given,
         the JavaScript will only be build if necessary.
-    source_dir: str, optional
-        The source code directory.
+    source_dir: str or list, optional
+        The source code directory, or a list of source files and
+        directories.
     build_cmd: str, optional
         The npm command to build assets to the build_dir.
     npm: str or list, optional.
         The npm executable name, or a tuple of ['node', executable].
+
+    The contents of the sources and targets of the install and build steps
+    are tracked in a build manifest in `node_modules/.cache`, and a step is
+    skipped when they have not changed since it last ran.
     """
 
     class NPM(BaseCommand):
@@ -357,16 +443,39 @@ def install_npm(path=None, build_dir=None, source_dir=None, build_cmd='build',
                           .format(npm_cmd[0]))
                 return
 
-            if force or is_stale(node_modules, pjoin(node_package, 'package.json')):
+            manifest = BuildManifest(
+                pjoin(node_modules, '.cache', 'setupbase', 'manifest.json'))
+            install_sources = [
+                pjoin(node_package, fname)
+                for fname in ('package.json', 'yarn.lock', 'package-lock.json')
+                if os.path.exists(pjoin(node_package, fname))
+            ]
+            install_args = (install_sources, [node_modules])
+            if force or manifest.is_stale('install', *install_args):
                 log.info('Installing build dependencies with npm.  This may '
                          'take a while...')
                 run(npm_cmd + ['install'], cwd=node_package)
-            if build_dir and source_dir and not force:
-                should_build = is_stale(build_dir, source_dir)
+                manifest.record('install', *install_args, hash_targets=False)
+            else:
+                log.info('Skipping npm install, dependencies are unchanged')
+
+            build_step = 'build:%s' % build_cmd
+            build_args = None
+            if build_dir and source_dir:
+                sources = source_dir
+                if not isinstance(sources, (list, tuple)):
+                    sources = [sources]
+                build_args = (list(sources) + install_sources, [build_dir])
+            if build_args and not force:
+                should_build = manifest.is_stale(build_step, *build_args)
             else:
                 should_build = True
             if should_build:
                 run(npm_cmd + ['run', build_cmd], cwd=node_package)
+                if build_args:
+                    manifest.record(build_step, *build_args)
+            else:
+                log.info('Skipping npm build, sources are unchanged')
 
     return NPM
 
@@ -589,26 +698,52 @@ def _get_files(file_patterns, top=None):
     if not isinstance(file_patterns, (list, tuple)):
         file_patterns = [file_patterns]
 
-    for i, p in enumerate(file_patterns):
-        if os.path.isabs(p):
-            file_patterns[i] = os.path.relpath(p, top)
+    file_patterns = tuple(
+        os.path.relpath(p, top) if os.path.isabs(p) else p
+        for p in file_patterns
+    )
 
-    matchers = [_compile_pattern(p) for p in file_patterns]
+    # A single regex tests each file against all the patterns, and
+    # directories that no pattern can reach are not walked.
+    match = _compile_patterns(file_patterns)
+    prefixes = [_compile_prefix(p) for p in file_patterns]
 
-    files = set()
+    def can_contain_match(dir_parts):
+        for (matchers, recursive) in prefixes:
+            if len(dir_parts) > len(matchers) and not recursive:
+                continue
+            if all(m(part) for (m, part) in zip(matchers, dir_parts)):
+                return True
+        return False
 
-    for root, dirnames, filenames in os.walk(top):
-        # Don't recurse into node_modules
-        if 'node_modules' in dirnames:
-            dirnames.remove('node_modules')
-        for m in matchers:
-            for filename in filenames:
-                fn = os.path.relpath(_glob_pjoin(root, filename), top)
-                fn = fn.replace(os.sep, '/')
-                if m(fn):
-                    files.add(fn)
+    files = []
+    stack = [()]
+    while stack:
+        dir_parts = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(top, *dir_parts))
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    # Like `os.walk`, don't follow symlinks to directories,
+                    # and don't recurse into node_modules.
+                    if entry.name == 'node_modules' or entry.is_symlink():
+                        continue
+                    child_parts = dir_parts + (entry.name,)
+                    if can_contain_match(child_parts):
+                        stack.append(child_parts)
+                else:
+                    fn = '/'.join(dir_parts + (entry.name,))
+                    if match(fn):
+                        files.append(fn)
 
-    return list(files)
+    return files
 
 
 def _get_package_data(root, file_patterns=None):
@@ -632,6 +767,7 @@ def _get_package_data(root, file_patterns=None):
     return _get_files(file_patterns, _glob_pjoin(os.path.abspath(os.getcwd()), root))
 
 
+@functools.lru_cache(maxsize=None)
 def _compile_pattern(pat, ignore_case=True):
     """Translate and compile a glob pattern to a regular expression matcher."""
     if isinstance(pat, bytes):
@@ -644,6 +780,46 @@ def _compile_pattern(pat, ignore_case=True):
     return re.compile(res, flags=flags).match
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_patterns(pats, ignore_case=True):
+    """Translate and compile a tuple of glob patterns to a single regular
+    expression matcher, which matches when any of the patterns match."""
+    # Strip the `(?ms)` flags prefix of each translation, as the flags
+    # can only be given once at the start of the combined expression.
+    res = '|'.join('(?:%s)' % _translate_glob(p)[5:] for p in pats)
+    flags = re.MULTILINE | re.DOTALL
+    if ignore_case:
+        flags |= re.IGNORECASE
+    return re.compile(res, flags=flags).match
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_prefix(pat, ignore_case=True):
+    """Compile the directory parts of a glob pattern, to tell which
+    directories can contain a match.
+
+    Returns
+    -------
+    A tuple of the matchers for the directory parts before the first `**`,
+    and whether the pattern has a `**`, in which case any directory below
+    those parts can contain a match.
+    """
+    parts = list(_iexplode_path(pat))
+    recursive = '**' in parts
+    if recursive:
+        parts = parts[:parts.index('**')]
+    else:
+        parts = parts[:-1]
+    flags = re.DOTALL
+    if ignore_case:
+        flags |= re.IGNORECASE
+    matchers = tuple(
+        re.compile(_translate_glob_part(part) + '\\Z', flags=flags).match
+        for part in parts
+    )
+    return matchers, recursive
+
+
 def _iexplode_path(path):
     """Iterate over all the parts of a path.
 
@@ -661,6 +837,7 @@ def _iexplode_path(path):
     yield tail
 
 
+@functools.lru_cache(maxsize=None)
 def _translate_glob(pat):
     """Translate a glob PATTERN to a regular expression."""
     translated_parts = []
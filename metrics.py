@@ -0,0 +1,229 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Startup and request metrics for the federated example app, rendered in the
+Prometheus text exposition format.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import time
+
+# The default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0
+)
+
+# The content type of the Prometheus text exposition format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('\n', '\\n').replace('"', '\\"'))
+        for (name, value) in pairs
+    )
+
+
+class Metric(object):
+    """The base class of the metrics, holding one series per label set.
+
+    Parameters
+    ----------
+    name: str
+        The metric name.
+    documentation: str
+        The help text of the metric.
+    labelnames: tuple of str, optional
+        The names of the labels that every observation must give.
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('%s expects the labels %s, got %s' % (
+                self.name, self.labelnames, tuple(labels)))
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        """Render the metric in the Prometheus text format."""
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.type_name)
+        ]
+        with self._lock:
+            series = [(key, self._copy(value))
+                      for (key, value) in self._series.items()]
+        for (key, value) in series:
+            lines.extend(self._render_series(key, value))
+        return '\n'.join(lines)
+
+    def _copy(self, value):
+        return value
+
+    def _render_series(self, key, value):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A monotonically increasing counter."""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        yield '%s%s %s' % (self.name, _format_labels(self.labelnames, key),
+                           _format_value(value))
+
+
+class Histogram(Metric):
+    """A histogram of observed values with cumulative buckets."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0]
+            counts = series[0]
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, value):
+        return [list(value[0]), value[1]]
+
+    def _render_series(self, key, value):
+        counts, total = value
+        cumulative = 0
+        for (bound, count) in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key,
+                                    [('le', _format_value(bound))])
+            yield '%s_bucket%s %d' % (self.name, labels, cumulative)
+        labels = _format_labels(self.labelnames, key)
+        yield '%s_sum%s %s' % (self.name, labels, _format_value(total))
+        yield '%s_count%s %d' % (self.name, labels, cumulative)
+
+
+class MetricsRegistry(object):
+    """A collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('Duplicate metric %s' % metric.name)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Render all the metrics in the Prometheus text format."""
+        return ''.join(m.render() + '\n' for m in self._metrics.values())
+
+
+class LabMetrics(MetricsRegistry):
+    """The metrics of the federated example app.
+
+    Every request is recorded by `log_request`, which wraps the `log_function`
+    of the web application.
+    """
+
+    def __init__(self, prefix='jupyterlab_federated_'):
+        super().__init__()
+        self.initialize_handlers_seconds = self.register(Histogram(
+            prefix + 'initialize_handlers_seconds',
+            'Time spent initializing the server handlers.'
+        ))
+        self.discovery_seconds = self.register(Histogram(
+            prefix + 'discovery_seconds',
+            'Time spent revalidating the federated extension index.'
+        ))
+        self.template_render_seconds = self.register(Histogram(
+            prefix + 'template_render_seconds',
+            'Time spent rendering a page template.',
+            ('template',)
+        ))
+        self.page_cache_total = self.register(Counter(
+            prefix + 'page_cache_total',
+            'Lookups of the rendered index page cache.',
+            ('result',)
+        ))
+        self.asset_cache_total = self.register(Counter(
+            prefix + 'asset_cache_total',
+            'Lookups of the in-memory asset cache.',
+            ('result',)
+        ))
+        self.request_duration_seconds = self.register(Histogram(
+            prefix + 'request_duration_seconds',
+            'Time spent handling a request.',
+            ('handler', 'method', 'code')
+        ))
+        self.response_bytes_total = self.register(Counter(
+            prefix + 'response_bytes_total',
+            'Bytes sent in response bodies, as given by Content-Length.',
+            ('handler',)
+        ))
+
+    def log_request(self, handler):
+        """Record the latency and response size of a finished request."""
+        name = type(handler).__name__
+        self.request_duration_seconds.observe(
+            handler.request.request_time(),
+            handler=name,
+            method=handler.request.method,
+            code=str(handler.get_status())
+        )
+        size = handler._headers.get('Content-Length')
+        self.response_bytes_total.inc(int(size) if size else 0, handler=name)
+
+    def wrap_log_function(self, log_function):
+        """Wrap a Tornado `log_function` so it also records each request."""
+        def log_function_with_metrics(handler):
+            self.log_request(handler)
+            if log_function is not None:
+                log_function(handler)
+        return log_function_with_metrics
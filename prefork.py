@@ -0,0 +1,193 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+A pre-fork mode for the server.
+
+The server is initialized once, so the extension discovery, the handlers
+and the page config are all set up in the parent process, and it binds its
+listening sockets without serving them.  It then forks worker processes,
+which inherit the sockets and share the incoming connections, each running
+its own event loop.  The parent only supervises the workers: it restarts a
+worker that crashes, and stops them all when it is asked to stop or when
+one of them shuts down.
+
+The connections of a client are spread over the workers, so the services
+that keep their state in the process that serves them, the kernels, the
+sessions and the terminals, are disabled.
+"""
+import asyncio
+import logging
+import os
+import signal
+
+from jupyter_server.serverapp import ServerApp
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from traitlets import default
+
+# The number of times crashed workers are restarted before giving up.
+MAX_RESTARTS = 100
+
+# The services that only work when served from a single process.
+PROCESS_SERVICES = ('kernels', 'sessions')
+
+
+class _SocketCollector(object):
+    """Stands in for the HTTP server while binding, to collect the listening
+    sockets instead of serving them from the event loop of the parent."""
+
+    def __init__(self):
+        self.sockets = []
+
+    def listen(self, port, address=None, **kwargs):
+        self.sockets.extend(bind_sockets(port, address=address, **kwargs))
+
+    def add_socket(self, socket):
+        self.sockets.append(socket)
+
+
+class PreforkServerApp(ServerApp):
+    """A server that can serve from several worker processes.
+
+    The server runs in a single process unless `prefork` is called before
+    the HTTP server is initialized, which an extension does from its
+    `initialize_handlers`.  The kernels, sessions and terminals are always
+    disabled.
+    """
+
+    workers = 1
+
+    default_services = tuple(
+        s for s in ServerApp.default_services if s not in PROCESS_SERVICES
+    )
+
+    @default('log')
+    def _log_default(self):
+        # Log as the stock server.
+        log = logging.getLogger(ServerApp.__name__)
+        log.propagate = False
+        return log
+
+    def get_default_logging_config(self):
+        config = super().get_default_logging_config()
+        loggers = config.get('loggers', {})
+        if self.__class__.__name__ in loggers:
+            loggers[ServerApp.__name__] = loggers.pop(self.__class__.__name__)
+        return config
+
+    def init_webapp(self):
+        self.terminals_enabled = False
+        super().init_webapp()
+
+    def prefork(self, workers, callbacks=()):
+        """Serve from several worker processes.
+
+        Parameters
+        ----------
+        workers: int
+            The number of worker processes.
+        callbacks: list of callable, optional
+            The functions to call in each worker once its event loop is
+            set up, to start anything that runs on the event loop.
+        """
+        self.workers = workers
+        self._worker_callbacks = list(callbacks)
+
+    def _bind_http_server(self):
+        if self.workers <= 1:
+            return super()._bind_http_server()
+        http_server, self._http_server = self._http_server, _SocketCollector()
+        try:
+            success = super()._bind_http_server()
+            self._worker_sockets = self._http_server.sockets
+        finally:
+            self._http_server = http_server
+        return success
+
+    def start_ioloop(self):
+        if self.workers <= 1:
+            return super().start_ioloop()
+        self._worker_pids = dict()
+        self._stopping = False
+        self._restarts = 0
+        for worker_id in range(self.workers):
+            self._fork_worker(worker_id)
+        self._supervise()
+
+    def _fork_worker(self, worker_id):
+        pid = os.fork()
+        if pid:
+            self._worker_pids[pid] = worker_id
+            return
+        # The worker must never return to the supervisor loop.
+        code = 0
+        try:
+            self._run_worker(worker_id)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            self.log.exception('Worker %i failed', worker_id)
+            code = 1
+        os._exit(code)
+
+    def _run_worker(self, worker_id):
+        # The event loop of the parent holds its own file descriptors, so
+        # each worker replaces it with a fresh one.
+        self.io_loop.close()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.io_loop = IOLoop.current()
+
+        # The parent stops the workers on an interrupt.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self._signal_stop)
+
+        self.http_server.add_sockets(self._worker_sockets)
+        self.init_shutdown_no_activity()
+        for callback in self._worker_callbacks:
+            callback()
+        self.log.info('Worker %i started (pid %i)', worker_id, os.getpid())
+        super().start_ioloop()
+
+    def _stop_workers(self, sig, frame):
+        if not self._stopping:
+            self.log.critical('received signal %s, stopping the workers', sig)
+            self._stopping = True
+        self._signal_workers(signal.SIGTERM)
+
+    def _signal_workers(self, sig):
+        for pid in self._worker_pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def _supervise(self):
+        """Wait for the workers, restarting the ones that crash, and clean
+        up once they have all exited."""
+        signal.signal(signal.SIGINT, self._stop_workers)
+        signal.signal(signal.SIGTERM, self._stop_workers)
+        while self._worker_pids:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            worker_id = self._worker_pids.pop(pid, None)
+            if worker_id is None or self._stopping:
+                continue
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                # A worker that shut down cleanly shuts the server down.
+                self.log.info('Worker %i exited, stopping the workers',
+                              worker_id)
+                self._stopping = True
+                self._signal_workers(signal.SIGTERM)
+            elif self._restarts < MAX_RESTARTS:
+                self.log.warning('Worker %i (pid %i) exited with status %i, '
+                                 'restarting it', worker_id, pid, status)
+                self._restarts += 1
+                self._fork_worker(worker_id)
+            else:
+                self.log.critical('Too many worker restarts, stopping')
+                self._stopping = True
+                self._signal_workers(signal.SIGTERM)
+        self.io_loop.run_sync(self._cleanup)
@@ -8,8 +8,17 @@ and add instrument them with a puppeteer test that makes sure
 there are no console errors or uncaught errors prior to a sentinel
 string being printed.
 e.g. python example_check.py ./app
+
+With `--benchmark`, the page is instead loaded repeatedly with a cold and
+then a warm browser cache, and the startup timings are written to a JSON
+file.  Two such files can be compared with `--compare`.
+e.g. python run.py --benchmark bench.json --runs 5
+     python run.py --compare base.json bench.json
 """
+import argparse
+from functools import partial
 import importlib.util
+import json
 import logging
 from os import path as osp
 import os
@@ -25,7 +34,7 @@ from jupyterlab.browser_check import run_test
 here = osp.abspath(osp.dirname(__file__))
 
 
-def main():
+def main(benchmark=None, runs=5):
     # Load the main file and grab the example class so we can subclass
     mod_path = osp.abspath(osp.join(here, 'main.py'))
     spec = importlib.util.spec_from_file_location("example", mod_path)
@@ -44,7 +53,11 @@ def main():
         browser_test = True
 
         def initialize_settings(self):
-            run_test(self.serverapp, run_browser)
+            if benchmark:
+                run_test(self.serverapp,
+                         partial(run_benchmark, output=benchmark, runs=runs))
+            else:
+                run_test(self.serverapp, run_browser)
             super().initialize_settings()
 
     def _jupyter_server_extension_points():
@@ -61,17 +74,84 @@ def main():
     App.launch_instance()
 
 
-def run_browser(url):
-    """Run the browser test and return an exit code.
+def get_test_dir(script):
+    """Get the directory with puppeteer installed, and copy a script to it.
     """
     target = osp.join(get_app_dir(), 'example_test')
     if not osp.exists(osp.join(target, 'node_modules')):
         os.makedirs(target)
         subprocess.call(["jlpm", "init", "-y"], cwd=target)
         subprocess.call(["jlpm", "add", "puppeteer@^2"], cwd=target)
-    shutil.copy(osp.join(here, 'chrome-test.js'), osp.join(target, 'chrome-test.js'))
+    shutil.copy(osp.join(here, script), osp.join(target, script))
+    return target
+
+
+def run_browser(url):
+    """Run the browser test and return an exit code.
+    """
+    target = get_test_dir('chrome-test.js')
     return subprocess.check_call(["node", "chrome-test.js", url], cwd=target)
 
 
+def run_benchmark(url, output, runs):
+    """Run the startup benchmark and return an exit code.
+    """
+    target = get_test_dir('chrome-benchmark.js')
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=here).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ''
+    return subprocess.check_call(
+        ["node", "chrome-benchmark.js", url, osp.abspath(output), str(runs),
+         commit],
+        cwd=target
+    )
+
+
+def compare(base_path, path):
+    """Print the change in the median timings between two benchmark files.
+    """
+    with open(base_path) as fid:
+        base = json.load(fid)
+    with open(path) as fid:
+        result = json.load(fid)
+
+    def row(label, old, new):
+        if old is None or new is None:
+            change = ''
+        elif old:
+            change = '%+.1f%%' % ((new - old) * 100.0 / old)
+        else:
+            change = '%+g' % (new - old)
+        print('%-40s %12s %12s %9s' % (
+            label,
+            '' if old is None else '%.1f' % old,
+            '' if new is None else '%.1f' % new,
+            change
+        ))
+
+    print('%-40s %12s %12s %9s' % (
+        '', base.get('commit', '')[:10], result.get('commit', '')[:10], ''))
+    for cache in ('cold', 'warm'):
+        old = base[cache]['summary']
+        new = result[cache]['summary']
+        for key in ('restoredMs', 'requests', 'bytes', 'scriptMs', 'taskMs'):
+            row('%s %s' % (cache, key), old.get(key), new.get(key))
+        for name in sorted(set(old['remotes']) | set(new['remotes'])):
+            row('%s remote %s' % (cache, name), old['remotes'].get(name),
+                new['remotes'].get(name))
+
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--benchmark', metavar='OUTPUT')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'RESULT'))
+    args, rest = parser.parse_known_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    # Leave the remaining arguments to the application.
+    sys.argv = sys.argv[:1] + rest
+    main(benchmark=args.benchmark, runs=args.runs)
@@ -0,0 +1,160 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+A service worker that precaches the assets of the core bundle and of the
+federated extensions.
+
+The build writes an asset manifest next to the assets of the core bundle
+and of each federated extension, mapping the path of every asset to a hash
+of its content.  The server merges the manifests into the precache list of
+the service worker script, so the script changes whenever an asset does.
+A new version of the worker fills a new cache, reusing the unchanged assets
+of the previous one, and only takes over once no page uses the previous
+one, so a page never mixes the assets of two versions.
+"""
+import hashlib
+import json
+import logging
+import os
+
+from jupyter_server.utils import url_path_join as ujoin
+
+from discovery import hash_file, stat_signature
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+
+# The asset manifest, in the output directory of each package.
+ASSET_MANIFEST = 'asset-manifest.json'
+
+# The service worker script, which the precache list is prepended to.
+SCRIPT_PATH = os.path.join(HERE, 'templates', 'service-worker.js')
+
+# The response header of the lab page with the version of the assets it
+# was rendered for, which the worker compares with its own.
+VERSION_HEADER = 'X-Lab-Assets-Version'
+
+# The asset types worth precaching.
+PRECACHE_EXTENSIONS = (
+    '.css', '.eot', '.gif', '.js', '.otf', '.png', '.svg', '.ttf', '.woff',
+    '.woff2'
+)
+
+# The directories of an extension that are not loaded from its url.
+SKIPPED_DIRS = ('schemas', 'themes')
+
+
+def write_asset_manifest(directory):
+    """Write the asset manifest of the federated extension in a directory.
+
+    Returns
+    -------
+    The path of the manifest.
+    """
+    files = dict()
+    for (root, dirnames, filenames) in os.walk(directory):
+        if root == directory:
+            dirnames[:] = [d for d in dirnames if d not in SKIPPED_DIRS]
+        for filename in filenames:
+            if not filename.endswith(PRECACHE_EXTENSIONS):
+                continue
+            path = os.path.join(root, filename)
+            rel_path = os.path.relpath(path, directory).replace(os.sep, '/')
+            files[rel_path] = hash_file(path)
+
+    manifest_path = os.path.join(directory, ASSET_MANIFEST)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as fid:
+        json.dump(dict(files=files), fid, indent=2, sort_keys=True)
+        fid.write('\n')
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
+
+
+class ServiceWorker(object):
+    """The service worker script, built from the asset manifests of the core
+    bundle and of the federated extensions, and rebuilt when one changes.
+
+    Parameters
+    ----------
+    static_dir: str
+        The output directory of the core bundle.
+    static_url: str
+        The absolute url path of the core bundle.
+    extensions_url: str
+        The absolute url path of the federated extensions.
+    index: discovery.ExtensionIndex, optional
+        The index of the federated extensions.
+    log: logging.Logger, optional
+        The logger to use.
+    """
+
+    def __init__(self, static_dir, static_url, extensions_url, index=None,
+                 log=None):
+        self.static_dir = static_dir
+        self.static_url = static_url
+        self.extensions_url = extensions_url
+        self.index = index
+        self.log = log or logging.getLogger(__name__)
+        with open(SCRIPT_PATH, encoding='utf-8') as fid:
+            self._template = fid.read()
+        # Manifest path -> (signature, files).
+        self._manifests = {}
+        # (signatures, version, script).
+        self._script = None
+
+    def _sources(self):
+        sources = [(self.static_dir, self.static_url)]
+        if self.index is not None:
+            sources.extend(
+                (ext_data['ext_path'], ujoin(self.extensions_url, name))
+                for (name, ext_data) in self.index.extensions.items()
+            )
+        return sources
+
+    def get(self):
+        """Get the version of the assets and the service worker script.
+
+        Returns
+        -------
+        A (version, script) tuple where the script is bytes.
+        """
+        sources = [(os.path.join(directory, ASSET_MANIFEST), url)
+                   for (directory, url) in self._sources()]
+        signatures = [(path, stat_signature(path)) for (path, _) in sources]
+        if self._script is not None and self._script[0] == signatures:
+            return self._script[1], self._script[2]
+
+        manifests = dict()
+        assets = []
+        for (path, url) in sources:
+            files = self._load(path)
+            if files is None:
+                continue
+            manifests[path] = self._manifests[path]
+            assets.extend([ujoin(url, rel_path), revision]
+                          for (rel_path, revision) in sorted(files.items()))
+        self._manifests = manifests
+
+        data = json.dumps(assets, separators=(',', ':'))
+        version = hashlib.sha256(data.encode('utf-8')).hexdigest()[:20]
+        script = ('self.__PRECACHE = {"version":"%s","assets":%s};\n%s' % (
+            version, data, self._template)).encode('utf-8')
+        self._script = (signatures, version, script)
+        return version, script
+
+    def _load(self, path):
+        sig = stat_signature(path)
+        if sig is None:
+            return None
+        cached = self._manifests.get(path)
+        if cached and cached[0] == sig:
+            return cached[1]
+        try:
+            with open(path) as fid:
+                files = json.load(fid)['files']
+        except (OSError, ValueError, KeyError) as e:
+            self.log.warning('Ignoring invalid asset manifest %s: %s', path, e)
+            return None
+        self._manifests[path] = (sig, files)
+        return files
@@ -0,0 +1,425 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+An in-memory cache of the plugin settings served by the settings API.
+
+Parsed schemas, package versions and user settings are keyed by the stat
+signature of their files, so a request only stats the files and nothing is
+read or parsed again until it changes on disk.  The schema validators are
+built once per schema and shared by every load and write.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+
+import json5
+from jsonschema import Draft4Validator as Validator, ValidationError
+from jsonschema.exceptions import best_match
+from jupyterlab_server.settings_handler import (
+    SETTINGS_EXTENSION, _get_overrides, _override, _path
+)
+from jupyterlab_server.server import tz
+from tornado import web
+
+from discovery import stat_signature
+
+# The file that overrides the schema defaults in the app settings directory.
+OVERRIDES_FILE = 'overrides.json'
+
+# The package metadata next to the schemas of a package.
+VERSION_FILE = 'package.json.orig'
+
+# The schema keywords that constrain a settings object as a whole, rather
+# than the value of each of its properties on its own.
+OBJECT_KEYWORDS = (
+    'allOf', 'anyOf', 'const', 'dependencies',
+    'dependentRequired', 'dependentSchemas', 'else', 'enum', 'if',
+    'maxProperties', 'minProperties', 'not', 'oneOf', 'patternProperties',
+    'propertyNames', 'required', 'then', 'unevaluatedProperties', '$ref'
+)
+
+
+class ValidatorCache(object):
+    """An LRU cache of schema validators, keyed by the hash of the schema.
+
+    Parameters
+    ----------
+    max_size: int, optional
+        The number of validators to keep.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._validators = OrderedDict()
+
+    def get(self, schema, digest=None):
+        """Get the validator of a schema.
+
+        Parameters
+        ----------
+        schema: dict
+            The schema, which must already be checked.
+        digest: str, optional
+            The hash of the schema, computed when not given.
+        """
+        if digest is None:
+            digest = get_schema_digest(schema)
+        validator = self._validators.get(digest)
+        if validator is not None:
+            self.hits += 1
+            self._validators.move_to_end(digest)
+            return validator
+        self.misses += 1
+        validator = self._validators[digest] = Validator(schema)
+        if len(self._validators) > self.max_size:
+            self._validators.popitem(last=False)
+        return validator
+
+
+def get_schema_digest(schema):
+    """Get a hash of the contents of a schema."""
+    data = json.dumps(schema, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def _dump(value):
+    return json.dumps(value, sort_keys=True)
+
+
+def validate_changes(validator, old, new):
+    """Validate settings that only differ in a few keys from settings that
+    are known to be valid against the same schema.
+
+    Only the changed properties are validated when the schema constrains
+    each property on its own.  Otherwise the whole settings are validated.
+
+    Raises
+    ------
+    jsonschema.ValidationError
+        If the new settings are invalid.
+    """
+    schema = validator.schema
+    properties = schema.get('properties', {})
+    if (not isinstance(new, dict) or schema.get('type', 'object') != 'object'
+            or any(key in schema for key in OBJECT_KEYWORDS)):
+        validator.validate(new)
+        return
+    # JSON values are compared as JSON, since `True == 1` in Python.
+    changed = [key for key in set(old) | set(new)
+               if key not in old or key not in new
+               or _dump(old[key]) != _dump(new[key])]
+    if any(key not in properties for key in changed):
+        validator.validate(new)
+        return
+    errors = []
+    for key in changed:
+        if key in new:
+            errors.extend(validator.descend(new[key], properties[key],
+                                            path=key))
+    error = best_match(errors)
+    if error is not None:
+        raise error
+
+
+class SettingsCache(object):
+    """A cache of the schemas and user settings of the core plugins and of
+    the federated extensions.
+
+    The schemas of the federated extensions take precedence over the core
+    schemas, as they do in `jupyterlab_server`.
+
+    Parameters
+    ----------
+    app_settings_dir: str
+        The directory with the `overrides.json` of the schema defaults.
+    schemas_dir: str
+        The directory with the core schemas.
+    settings_dir: str
+        The directory with the user settings.
+    index: discovery.ExtensionIndex, optional
+        The index of the federated extensions, whose `schemas` directories
+        are searched for schemas.
+    log: logging.Logger, optional
+        The logger to use.
+    """
+
+    def __init__(self, app_settings_dir, schemas_dir, settings_dir,
+                 index=None, log=None):
+        self.app_settings_dir = app_settings_dir
+        self.schemas_dir = schemas_dir
+        self.settings_dir = settings_dir
+        self.index = index
+        self.log = log or logging.getLogger(__name__)
+        self._overrides = (None, {})
+        # Schemas directory -> (directory signatures, schema name -> path).
+        self._listings = {}
+        # Schema path -> (key, schema, version).
+        self._schemas = {}
+        # Schema name -> (key, user settings).
+        self._user_settings = {}
+        self._batch = (None, None)
+        self.validators = ValidatorCache()
+
+    @property
+    def overrides(self):
+        """The overrides of the schema defaults, reloaded when
+        `overrides.json` changes."""
+        sig = stat_signature(os.path.join(self.app_settings_dir, OVERRIDES_FILE))
+        if sig != self._overrides[0]:
+            overrides, error = _get_overrides(self.app_settings_dir)
+            if error:
+                self.log.warning('Failed loading overrides: %s', error)
+            self._overrides = (sig, overrides)
+        return self._overrides[1]
+
+    def get(self, schema_name):
+        """Get the settings of a plugin, or None if it has no schema.
+
+        Returns
+        -------
+        A (plugin, warning) tuple, where the plugin has the same fields as
+        the response of the settings API.
+        """
+        path = self._list_schemas().get(schema_name)
+        if path is None:
+            return None, None
+        overrides = self.overrides
+        return self._get_plugin(schema_name, path, overrides)
+
+    def validate(self, schema_name, settings):
+        """Validate new user settings for a plugin against its schema.
+
+        Only the changed keys are validated when the current user settings
+        are valid and the schema allows it.  Settings that cannot be read
+        are replaced, so they are not an error here.
+
+        Returns
+        -------
+        False if the plugin has no schema, True otherwise.
+
+        Raises
+        ------
+        jsonschema.ValidationError
+            If the settings are invalid.
+        """
+        path = self._list_schemas().get(schema_name)
+        if path is None:
+            return False
+        schema, _, digest = self._get_schema(schema_name, path, self.overrides)
+        validator = self.validators.get(schema, digest)
+        try:
+            current = self._get_user_settings(schema_name, path, schema,
+                                              digest)
+        except web.HTTPError:
+            current = None
+        if (current is not None and current['warning'] is None and
+                isinstance(settings, dict)):
+            validate_changes(validator, current['settings'], settings)
+        else:
+            validator.validate(settings)
+        return True
+
+    def write(self, schema_name, raw, settings):
+        """Write validated user settings for a plugin, and keep them so they
+        are not read and validated again."""
+        path = _path(self.settings_dir, schema_name, True, SETTINGS_EXTENSION)
+        with open(path, 'w', encoding='utf-8') as fid:
+            fid.write(raw)
+        schema_path = self._list_schemas().get(schema_name)
+        if schema_path is None:
+            return
+        key = [self._user_key(schema_name), self._schema_key(schema_path)]
+        user_settings = _get_file_times(path)
+        user_settings.update(raw=raw, settings=settings, warning=None)
+        self._user_settings[schema_name] = (key, user_settings)
+
+    def get_batch(self):
+        """Get the settings of every plugin in a single response.
+
+        The ETag is computed from the stat signatures of the files, so an
+        unchanged batch is neither rebuilt nor serialized again.
+
+        Returns
+        -------
+        A (body, etag, warnings) tuple, where the body is the JSON response of
+        the settings API listing, as bytes.
+        """
+        overrides = self.overrides
+        schemas = self._list_schemas()
+        names = sorted(schemas, reverse=True)
+        keys = [self._overrides[0]]
+        for name in names:
+            keys.append([name, self._schema_key(schemas[name]),
+                         self._user_key(name)])
+        etag = '"%s"' % hashlib.sha1(
+            json.dumps(keys).encode('utf-8')).hexdigest()
+        if etag == self._batch[0]:
+            return self._batch[1], etag, []
+
+        settings = []
+        warnings = []
+        for name in names:
+            plugin, warning = self._get_plugin(name, schemas[name], overrides)
+            settings.append(plugin)
+            if warning:
+                warnings.append(warning)
+        body = json.dumps(dict(settings=settings)).encode('utf-8')
+        self._batch = (etag, body)
+
+        # Forget the plugins that are gone.
+        paths = set(schemas.values())
+        for path in [p for p in self._schemas if p not in paths]:
+            del self._schemas[path]
+        for name in [n for n in self._user_settings if n not in schemas]:
+            del self._user_settings[name]
+        return body, etag, warnings
+
+    def _get_plugin(self, schema_name, path, overrides):
+        schema, version, digest = self._get_schema(schema_name, path, overrides)
+        user_settings = self._get_user_settings(schema_name, path, schema,
+                                                digest)
+        plugin = dict(id=schema_name, schema=schema, version=version)
+        plugin.update(user_settings)
+        warning = plugin.pop('warning')
+        return plugin, warning
+
+    def _schema_key(self, path):
+        version_path = os.path.join(os.path.dirname(path), VERSION_FILE)
+        return [stat_signature(path), stat_signature(version_path),
+                self._overrides[0]]
+
+    def _user_key(self, schema_name):
+        path = _path(self.settings_dir, schema_name, False, SETTINGS_EXTENSION)
+        return stat_signature(path)
+
+    def _get_schema(self, schema_name, path, overrides):
+        """Get a parsed and checked schema with its package version and
+        hash."""
+        key = self._schema_key(path)
+        cached = self._schemas.get(path)
+        if cached and cached[0] == key:
+            return cached[1:]
+
+        try:
+            with open(path, encoding='utf-8') as fid:
+                schema = json.load(fid)
+        except Exception as e:
+            raise web.HTTPError(500, 'Failed parsing schema (%s): %s'
+                                % (schema_name, e))
+        schema = _override(schema_name, schema, overrides)
+        try:
+            Validator.check_schema(schema)
+        except Exception as e:
+            raise web.HTTPError(500, 'Failed validating schema (%s): %s'
+                                % (schema_name, e))
+
+        version = 'N/A'
+        version_path = os.path.join(os.path.dirname(path), VERSION_FILE)
+        try:
+            with open(version_path, encoding='utf-8') as fid:
+                version = json.load(fid)['version']
+        except Exception:
+            pass
+
+        digest = get_schema_digest(schema)
+        self._schemas[path] = (key, schema, version, digest)
+        return schema, version, digest
+
+    def _get_user_settings(self, schema_name, path, schema, digest):
+        """Get the parsed and validated user settings of a plugin, which
+        are validated again when the schema changes."""
+        key = [self._user_key(schema_name), self._schema_key(path)]
+        cached = self._user_settings.get(schema_name)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        settings_path = _path(self.settings_dir, schema_name, False,
+                              SETTINGS_EXTENSION)
+        user_settings = dict(raw='{}', settings={}, warning=None,
+                             last_modified=None, created=None)
+        if os.path.exists(settings_path):
+            user_settings.update(_get_file_times(settings_path))
+            try:
+                with open(settings_path, encoding='utf-8') as fid:
+                    raw = fid.read() or '{}'
+                settings = json5.loads(raw)
+            except Exception as e:
+                raise web.HTTPError(500, 'Failed loading settings (%s): %s'
+                                    % (schema_name, e))
+            user_settings.update(raw=raw, settings=settings)
+            if settings:
+                try:
+                    self.validators.get(schema, digest).validate(settings)
+                except ValidationError as e:
+                    user_settings.update(
+                        raw='{}',
+                        warning='Failed validating settings (%s): %s'
+                        % (schema_name, e)
+                    )
+
+        self._user_settings[schema_name] = (key, user_settings)
+        return user_settings
+
+    def _list_schemas(self):
+        """Get a mapping of schema name to schema path."""
+        roots = []
+        if self.index is not None:
+            roots.extend(os.path.join(ext_data['ext_path'], 'schemas')
+                         for ext_data in self.index.extensions.values())
+        roots.append(self.schemas_dir)
+        schemas = dict()
+        listings = dict()
+        for root in roots:
+            listings[root] = self._list_root(root)
+            for (name, path) in listings[root][1].items():
+                schemas.setdefault(name, path)
+        self._listings = listings
+        return schemas
+
+    def _list_root(self, root):
+        """List the schemas in a schemas directory, reusing the cached
+        listing when none of its directories changed.
+        """
+        cached = self._listings.get(root)
+        if cached and all(stat_signature(d) == sig for (d, sig) in cached[0]):
+            return cached
+
+        dirs = []
+        schemas = dict()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            sig = stat_signature(path)
+            if sig is None:
+                if path == root:
+                    # A missing root is recorded too, so that creating it
+                    # invalidates the listing.
+                    dirs.append((path, None))
+                continue
+            dirs.append((path, sig))
+            try:
+                entries = list(os.scandir(path))
+            except OSError as e:
+                self.log.warning('Could not list %s: %s', path, e)
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.endswith('.json') and path != root:
+                    rel_dir = os.path.relpath(path, root).replace(os.sep, '/')
+                    schemas['%s:%s' % (rel_dir, entry.name[:-5])] = entry.path
+        return (dirs, schemas)
+
+
+def _get_file_times(path):
+    """Get the ISO modification and creation times of a file."""
+    st = os.stat(path)
+    return dict(
+        last_modified=tz.utcfromtimestamp(st.st_mtime).isoformat(),
+        created=tz.utcfromtimestamp(st.st_ctime).isoformat()
+    )
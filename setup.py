@@ -6,7 +6,8 @@ from setuptools import setup
 
 setup(name='jupyterlab-module-federation',
       version='0.1.0',
-      py_modules = ['main'],
+      py_modules = ['main', 'assets', 'discovery', 'handlers', 'metrics', 'prefork',
+                    'serviceworker', 'settings', 'themes', 'workspaces'],
       install_requires=[
         'jupyterlab==3.0.0a10'
     ],
@@ -0,0 +1,125 @@
+// Copyright (c) Jupyter Development Team.
+// Distributed under the terms of the Modified BSD License.
+
+// The server prepends the precache list as `self.__PRECACHE`: the `version`
+// of the assets, and the `[url, revision]` of every asset, where the
+// revision is a truncated sha256 of its content.
+const { version, assets } = self.__PRECACHE;
+
+const CACHE_PREFIX = 'jupyterlab-federated-';
+const VERSION_HEADER = 'X-Lab-Assets-Version';
+
+const cacheName = CACHE_PREFIX + version;
+const revisions = new Map(assets);
+
+// The pages that were rendered for other assets than ours, which load
+// their assets from the network.
+const staleClients = new Set();
+
+/**
+ * Get the key of a revision of an asset in the caches.
+ */
+function cacheKey(url, revision) {
+  return `${url}?__revision=${revision}`;
+}
+
+/**
+ * Get the revision of a response body, truncated to a given length.
+ */
+async function getRevision(response, length) {
+  const digest = await crypto.subtle.digest(
+    'SHA-256',
+    await response.clone().arrayBuffer()
+  );
+  return Array.from(new Uint8Array(digest))
+    .map(byte => byte.toString(16).padStart(2, '0'))
+    .join('')
+    .slice(0, length);
+}
+
+/**
+ * Cache an asset, reusing the same revision from the cache of a previous
+ * version.  Fails if the server has another revision, in which case a
+ * newer worker is on its way.
+ */
+async function precache(cache, url, revision) {
+  const key = cacheKey(url, revision);
+  let response = await caches.match(key);
+  if (!response) {
+    response = await fetch(url, { cache: 'no-cache' });
+    if (!response.ok) {
+      throw new Error(`Failed to fetch ${url}: ${response.status}`);
+    }
+    if ((await getRevision(response, revision.length)) !== revision) {
+      throw new Error(`${url} does not match revision ${revision}`);
+    }
+  }
+  await cache.put(key, response);
+}
+
+// A version is only installed once all of its assets are cached.
+self.addEventListener('install', event => {
+  event.waitUntil(
+    caches
+      .open(cacheName)
+      .then(cache =>
+        Promise.all(assets.map(([url, revision]) => precache(cache, url, revision)))
+      )
+  );
+});
+
+// A version is only activated once no page uses the previous one, so the
+// caches of the previous versions can go.
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys().then(names =>
+      Promise.all(
+        names
+          .filter(name => name.startsWith(CACHE_PREFIX) && name !== cacheName)
+          .map(name => caches.delete(name))
+      )
+    )
+  );
+});
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  if (request.method !== 'GET') {
+    return;
+  }
+
+  // Pages always come from the network, and say which assets they need.
+  if (request.mode === 'navigate') {
+    event.respondWith(
+      fetch(request).then(response => {
+        const pageVersion = response.headers.get(VERSION_HEADER);
+        if (pageVersion && pageVersion !== version) {
+          if (event.resultingClientId) {
+            staleClients.add(event.resultingClientId);
+          }
+          self.registration.update();
+        }
+        return response;
+      })
+    );
+    return;
+  }
+  if (staleClients.has(event.clientId)) {
+    return;
+  }
+
+  const url = new URL(request.url);
+  const revision =
+    url.origin === self.location.origin && revisions.get(url.pathname);
+  // Versioned urls, such as those of the remote entries, must match.
+  const requested = url.searchParams.get('v');
+  if (!revision || (requested && requested !== revision)) {
+    return;
+  }
+  event.respondWith(
+    caches
+      .open(cacheName)
+      .then(cache => cache.match(cacheKey(url.pathname, revision)))
+      .then(response => response || fetch(request))
+  );
+});
@@ -0,0 +1,81 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+import json
+import os
+
+import pytest
+
+from discovery import (
+    ExtensionIndex, ExtensionWatcher, get_combined_extensions,
+    get_remote_entries_key
+)
+
+
+def write_extension(root, name, data):
+    ext_path = os.path.join(root, name)
+    os.makedirs(ext_path)
+    with open(os.path.join(ext_path, 'package.json'), 'w') as fid:
+        json.dump(data, fid)
+
+
+@pytest.mark.parametrize('data', [
+    {'version': '1.0.0'},
+    {'name': ['@test/invalid']},
+    {'name': '@test/invalid', 'jupyterlab': None},
+    {'name': '@test/invalid', 'jupyterlab': ['extension']},
+    {'name': '@test/invalid', 'jupyterlab': 'extension'},
+    ['@test/invalid'],
+])
+def test_invalid_package_data_is_skipped(tmpdir, data):
+    root = str(tmpdir)
+    write_extension(root, 'invalid', data)
+    write_extension(root, 'valid', {
+        'name': '@test/valid', 'jupyterlab': {'extension': True}
+    })
+    index = ExtensionIndex([root], index_path='')
+    index.refresh()
+    assert list(index.extensions) == ['@test/valid']
+
+    page_config = {}
+    ExtensionWatcher(index, page_config, interval=0)
+    assert [e['name'] for e in page_config['dynamic_extensions']] == [
+        '@test/valid'
+    ]
+
+
+def test_lazy_extensions_are_not_combined():
+    eager = {'jupyterlab': {'extension': True}, 'remote_entry_hash': 'aaaa'}
+    lazy = {
+        'jupyterlab': {
+            'extension': True,
+            'activationTriggers': {'fileTypes': ['markdown']}
+        },
+        'remote_entry_hash': 'bbbb'
+    }
+    extensions = {'@test/eager': eager, '@test/lazy': lazy}
+    assert list(get_combined_extensions(extensions)) == ['@test/eager']
+    changed = dict(lazy, remote_entry_hash='cccc')
+    assert (get_remote_entries_key(extensions) ==
+            get_remote_entries_key(dict(extensions, **{'@test/lazy': changed})))
+
+
+def test_version_is_derived_from_the_content(tmpdir):
+    root = str(tmpdir)
+    write_extension(root, 'valid', {
+        'name': '@test/valid', 'jupyterlab': {'extension': True}
+    })
+    index = ExtensionIndex([root], index_path='')
+    index.refresh()
+    first = ExtensionWatcher(index, {}, interval=0)
+    second = ExtensionWatcher(index, {}, interval=0)
+    assert first.version == second.version
+    second._update()
+    assert first.version == second.version
+
+    write_extension(root, 'other', {
+        'name': '@test/other', 'jupyterlab': {'extension': True}
+    })
+    index.refresh()
+    second._update()
+    assert first.version != second.version
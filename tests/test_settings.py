@@ -0,0 +1,31 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+import pytest
+from jsonschema import ValidationError
+
+from settings import Validator, validate_changes
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'fontSize': {'type': 'integer'},
+        'flag': {'type': 'boolean'}
+    }
+}
+
+
+@pytest.mark.parametrize('old, new', [
+    ({'fontSize': 1}, {'fontSize': True}),
+    ({'flag': False}, {'flag': 0}),
+])
+def test_validate_changes_bool_int(old, new):
+    validator = Validator(SCHEMA)
+    validator.validate(old)
+    with pytest.raises(ValidationError):
+        validate_changes(validator, old, new)
+
+
+def test_validate_changes_unchanged():
+    validator = Validator(SCHEMA)
+    validate_changes(validator, {'fontSize': 1}, {'fontSize': 1, 'flag': True})
@@ -0,0 +1,31 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+import os
+
+from themes import THEME_BUNDLE, build_theme_bundle
+
+
+def write_theme(theme_dir, source):
+    with open(os.path.join(theme_dir, 'index.css'), 'w') as fid:
+        fid.write(source)
+
+
+def test_theme_is_bundled(tmpdir):
+    theme_dir = str(tmpdir)
+    write_theme(theme_dir, ':root { --a: red; }\nbody { color: var(--a); }\n')
+    assert build_theme_bundle(theme_dir)
+
+
+def test_nested_root_overrides_are_not_bundled(tmpdir):
+    theme_dir = str(tmpdir)
+    write_theme(theme_dir, ':root { --a: red; }\n')
+    assert build_theme_bundle(theme_dir)
+
+    write_theme(theme_dir, (
+        ':root { --a: red; }\n'
+        '@media (max-width: 600px) { :root { --a: blue; } }\n'
+    ))
+    assert build_theme_bundle(theme_dir) is None
+    assert os.listdir(theme_dir) == ['index.css']
+    assert not os.path.exists(os.path.join(theme_dir, THEME_BUNDLE))
@@ -0,0 +1,26 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+import json
+import os
+
+from workspaces import WorkspaceStore
+
+
+def workspace(value):
+    return {'data': {'value': value}, 'metadata': {'id': 'lab'}}
+
+
+def test_compact_all_folds_the_logs_into_the_snapshots(tmpdir):
+    directory = str(tmpdir)
+    store = WorkspaceStore(directory)
+    store.save('lab', workspace(1))
+    store.save('lab', workspace(2))
+    with open(os.path.join(directory, 'orphan.jupyterlab-workspace.log'),
+              'w') as fid:
+        fid.write('[]\n')
+
+    WorkspaceStore(directory).compact_all()
+    assert os.listdir(directory) == ['lab.jupyterlab-workspace']
+    with open(os.path.join(directory, 'lab.jupyterlab-workspace')) as fid:
+        assert json.load(fid) == workspace(2)
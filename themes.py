@@ -0,0 +1,407 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Precompiled theme bundles.
+
+A theme bundle splits the stylesheet of a theme into a minified,
+content-hashed stylesheet of its rules, and a map of the custom properties
+its `:root` rules declare.  The theme stylesheet that the theme manager
+loads is then only the custom properties and an import of the rules, which
+are served from a url of their hash alone.  The themes share most of their
+rules, so switching themes only fetches the custom properties, and only
+loads a stylesheet of rules when the rules differ.  The switch still goes
+through the theme manager, which replaces the theme stylesheet, so the
+page restyles as it does for any theme change.
+
+The custom properties come after the rules in the cascade, so a theme
+that overrides root custom properties within an at-rule such as `@media`
+is not bundled, as the overrides would lose to the base values.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+from urllib.parse import urlparse
+
+from jupyter_server.utils import url_path_join as ujoin
+
+from discovery import stat_signature
+
+# The manifest of a theme bundle, next to the theme stylesheet.
+THEME_BUNDLE = 'theme-bundle.json'
+
+# The stylesheet of a theme.
+THEME_STYLESHEET = 'index.css'
+
+# The prefix of the bundled rules stylesheet.
+BUNDLE_PREFIX = 'bundle.'
+
+URL_RE = re.compile(r'''url\(\s*(['"]?)([^'")]*)\1\s*\)''')
+
+
+def _tokenize(source):
+    """Split CSS source into strings, comments and other text."""
+    i = 0
+    start = 0
+    n = len(source)
+    while i < n:
+        char = source[i]
+        if char in '"\'':
+            if start < i:
+                yield 'text', source[start:i]
+            j = i + 1
+            while j < n and source[j] != char:
+                j += 2 if source[j] == '\\' else 1
+            yield 'string', source[i:j + 1]
+            i = start = j + 1
+        elif source.startswith('/*', i):
+            if start < i:
+                yield 'text', source[start:i]
+            j = source.find('*/', i + 2)
+            j = n if j == -1 else j + 2
+            yield 'comment', source[i:j]
+            i = start = j
+        else:
+            i += 1
+    if start < n:
+        yield 'text', source[start:]
+
+
+def minify_css(source):
+    """Minify CSS by dropping comments and needless whitespace."""
+    parts = []
+    text = []
+
+    def flush():
+        token = re.sub(r'\s+', ' ', ''.join(text))
+        parts.append(re.sub(r' ?([{};,>]) ?', r'\1', token))
+        del text[:]
+
+    for (kind, token) in _tokenize(source):
+        if kind == 'string':
+            flush()
+            parts.append(token)
+        else:
+            # A comment separates tokens like whitespace does.
+            text.append(' ' if kind == 'comment' else token)
+    flush()
+    return ''.join(parts).replace(';}', '}').strip()
+
+
+def _split_top_level(text, separator):
+    """Split text on a separator outside of strings and parentheses."""
+    parts = []
+    depth = 0
+    start = 0
+    quote = None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == '\\':
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+
+def _iter_blocks(css):
+    """Yield the top-level (prelude, body) blocks of minified CSS."""
+    i = 0
+    start = 0
+    depth = 0
+    quote = None
+    prelude = None
+    while i < len(css):
+        char = css[i]
+        if quote:
+            if char == '\\':
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                prelude = css[start:i]
+                start = i + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                yield prelude, css[start:i]
+                start = i + 1
+        elif char == ';' and depth == 0:
+            # A statement at-rule such as `@charset`.
+            yield css[start:i], None
+            start = i + 1
+        i += 1
+
+
+def split_theme(css):
+    """Split minified theme CSS into its rules and its root custom
+    properties.
+
+    Returns
+    -------
+    A (rules, variables) tuple, where the rules are the CSS without the
+    custom properties of the `:root` rules, and the variables are a dict of
+    custom property name to value.
+    """
+    rules = []
+    variables = dict()
+    for (prelude, body) in _iter_blocks(css):
+        prelude = prelude.strip()
+        if body is None:
+            rules.append(prelude + ';')
+            continue
+        if prelude != ':root':
+            rules.append('%s{%s}' % (prelude, body))
+            continue
+        rest = []
+        for decl in _split_top_level(body, ';'):
+            name, sep, value = decl.partition(':')
+            if name.strip().startswith('--') and sep:
+                variables[name.strip()] = value.strip()
+            elif decl.strip():
+                rest.append(decl)
+        if rest:
+            rules.append(':root{%s}' % ';'.join(rest))
+    return ''.join(rules), variables
+
+
+def has_nested_root_properties(css):
+    """Whether minified CSS declares root custom properties within an
+    at-rule, such as `@media` or `@supports`."""
+    for (prelude, body) in _iter_blocks(css):
+        if body is None or not prelude.strip().startswith('@'):
+            continue
+        for (inner, inner_body) in _iter_blocks(body):
+            if inner_body is None:
+                continue
+            inner = inner.strip()
+            if inner.startswith('@'):
+                if has_nested_root_properties('%s{%s}' % (inner, inner_body)):
+                    return True
+                continue
+            selectors = [sel.strip() for sel in _split_top_level(inner, ',')]
+            if ':root' in selectors and any(
+                    decl.strip().startswith('--')
+                    for decl in _split_top_level(inner_body, ';')):
+                return True
+    return False
+
+
+def _remove_bundle(theme_dir, keep=None):
+    for fname in os.listdir(theme_dir):
+        if (fname.startswith(BUNDLE_PREFIX) and fname.endswith('.css')
+                and fname != keep):
+            os.remove(os.path.join(theme_dir, fname))
+
+
+def build_theme_bundle(theme_dir):
+    """Build the bundle of the theme stylesheet in a directory.
+
+    Returns
+    -------
+    The path of the manifest, or None if there is no theme stylesheet or if
+    it cannot be bundled.
+    """
+    source_path = os.path.join(theme_dir, THEME_STYLESHEET)
+    if not os.path.exists(source_path):
+        return None
+    with open(source_path, encoding='utf-8') as fid:
+        source = fid.read()
+
+    css = minify_css(source)
+    if has_nested_root_properties(css):
+        manifest_path = os.path.join(theme_dir, THEME_BUNDLE)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        _remove_bundle(theme_dir)
+        return None
+
+    rules, variables = split_theme(css)
+    data = rules.encode('utf-8')
+    name = '%s%s.css' % (
+        BUNDLE_PREFIX, hashlib.sha256(data).hexdigest()[:20])
+
+    _remove_bundle(theme_dir, keep=name)
+    with open(os.path.join(theme_dir, name), 'wb') as fid:
+        fid.write(data)
+
+    manifest_path = os.path.join(theme_dir, THEME_BUNDLE)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as fid:
+        json.dump(dict(css=name, variables=variables), fid, indent=2,
+                  sort_keys=True)
+        fid.write('\n')
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
+
+
+def iter_theme_dirs(themes_dir):
+    """Yield the (name, directory) of each theme in a themes directory,
+    descending into `@scope` directories."""
+    if not os.path.isdir(themes_dir):
+        return
+    for name in sorted(os.listdir(themes_dir)):
+        path = os.path.join(themes_dir, name)
+        if not os.path.isdir(path):
+            continue
+        if name.startswith('@'):
+            for child in sorted(os.listdir(path)):
+                if os.path.isdir(os.path.join(path, child)):
+                    yield '%s/%s' % (name, child), os.path.join(path, child)
+        else:
+            yield name, path
+
+
+def build_theme_bundles(themes_dirs):
+    """Build the bundles of every theme in the given themes directories.
+
+    Returns
+    -------
+    The list of manifest paths that were written.
+    """
+    written = []
+    for themes_dir in themes_dirs:
+        for (_, theme_dir) in iter_theme_dirs(themes_dir):
+            path = build_theme_bundle(theme_dir)
+            if path:
+                written.append(path)
+    return written
+
+
+def _absolute_urls(text, base):
+    """Make the relative urls in CSS text absolute, relative to a base
+    url path."""
+    def replace(match):
+        quote, url = match.groups()
+        if not url or urlparse(url).scheme or url.startswith(('/', '#')):
+            return match.group()
+        return 'url(%s%s%s)' % (quote, ujoin(base, url), quote)
+    return URL_RE.sub(replace, text)
+
+
+class ThemeBundles(object):
+    """The theme bundles of the core themes and of the federated extensions,
+    kept in memory and reloaded when a manifest changes.
+
+    The theme served at `<themes_url>/<name>/index.css` is bundled as `name`.
+    Relative urls are made absolute, since the bundles are not served from
+    the theme directories, and the rules are then named by their hash, so
+    the themes with the same rules share their stylesheet.
+
+    Parameters
+    ----------
+    themes_dir: str
+        The directory with the core themes.
+    themes_url: str
+        The absolute url path of the themes, including the base url.
+    bundles_url: str
+        The absolute url path the stylesheets of rules are served from.
+    index: discovery.ExtensionIndex, optional
+        The index of the federated extensions, whose `themes` directories
+        are searched for bundles.
+    log: logging.Logger, optional
+        The logger to use.
+    """
+
+    def __init__(self, themes_dir, themes_url, bundles_url, index=None,
+                 log=None):
+        self.themes_dir = themes_dir
+        self.themes_url = themes_url
+        self.bundles_url = bundles_url
+        self.index = index
+        self.log = log or logging.getLogger(__name__)
+        # Manifest path -> (signature, bundle).
+        self._bundles = {}
+
+    def _themes_dirs(self):
+        dirs = []
+        if self.index is not None:
+            dirs.extend(os.path.join(ext_data['ext_path'], 'themes')
+                        for ext_data in self.index.extensions.values())
+        dirs.append(self.themes_dir)
+        return dirs
+
+    def get_bundles(self):
+        """Get the theme bundles, keyed by theme name.
+
+        Each bundle has the `css` bytes of the rules, their gzipped form
+        `css_gzip`, the `filename` of their stylesheet, the `variables`
+        map, and the theme `stylesheet` bytes that import the rules.
+        """
+        bundles = dict()
+        loaded = dict()
+        for themes_dir in self._themes_dirs():
+            for (name, theme_dir) in iter_theme_dirs(themes_dir):
+                if name in bundles:
+                    continue
+                path = os.path.join(theme_dir, THEME_BUNDLE)
+                bundle = self._load(name, theme_dir, path)
+                if bundle is not None:
+                    bundles[name] = bundle
+                    loaded[path] = self._bundles[path]
+        self._bundles = loaded
+        return bundles
+
+    def get_rules(self, filename):
+        """Get the bundle whose stylesheet of rules has a filename, or None.
+        """
+        for bundle in self.get_bundles().values():
+            if bundle['filename'] == filename:
+                return bundle
+        return None
+
+    def _load(self, name, theme_dir, path):
+        sig = stat_signature(path)
+        if sig is None:
+            return None
+        cached = self._bundles.get(path)
+        if cached and cached[0] == sig:
+            return cached[1]
+        try:
+            with open(path) as fid:
+                manifest = json.load(fid)
+            with open(os.path.join(theme_dir, manifest['css']), 'rb') as fid:
+                css = fid.read().decode('utf-8')
+        except (OSError, ValueError, KeyError) as e:
+            self.log.warning('Ignoring invalid theme bundle %s: %s', path, e)
+            return None
+        base = ujoin(self.themes_url, name)
+        variables = dict(
+            (key, _absolute_urls(value, base))
+            for (key, value) in manifest['variables'].items()
+        )
+        css = _absolute_urls(css, base).encode('utf-8')
+        filename = '%s%s.css' % (
+            BUNDLE_PREFIX, hashlib.sha256(css).hexdigest()[:20])
+        stylesheet = '@import url("%s");:root{%s}' % (
+            ujoin(self.bundles_url, filename),
+            ';'.join('%s:%s' % item for item in sorted(variables.items()))
+        )
+        bundle = dict(
+            filename=filename,
+            css=css,
+            css_gzip=gzip.compress(css),
+            variables=variables,
+            stylesheet=stylesheet.encode('utf-8')
+        )
+        self._bundles[path] = (sig, bundle)
+        return bundle
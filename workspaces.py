@@ -0,0 +1,387 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+An append-only store of lab workspaces.
+
+Each workspace is a snapshot in the same format as the `jupyterlab_server`
+workspace files, plus a log of the JSON patches saved since the snapshot.
+A save only appends the patch from the previous state, and the log is
+compacted into a new snapshot in the background once it grows.  Reads are
+served from an in-memory copy that is reloaded when the files are changed
+by another process.
+"""
+import copy
+import json
+import logging
+import os
+import threading
+
+from jupyterlab_server.server import tz
+from jupyterlab_server.workspaces_handler import WORKSPACE_EXTENSION
+from tornado.ioloop import IOLoop
+
+from discovery import stat_signature
+
+# The suffix of the patch log next to a workspace snapshot.
+LOG_EXTENSION = '.log'
+
+
+def _escape(token):
+    return token.replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def make_patch(old, new, path=''):
+    """Get the JSON patch operations that turn one document into another.
+
+    Objects are compared key by key, and any other changed value, lists
+    included, is replaced whole.  Every operation sets an absolute value, so
+    replaying a patch over a later state converges to the same document.
+    """
+    if not (isinstance(old, dict) and isinstance(new, dict)):
+        if old == new and type(old) is type(new):
+            return []
+        return [dict(op='replace', path=path, value=new)]
+    ops = []
+    for key in old:
+        if key not in new:
+            ops.append(dict(op='remove', path=path + '/' + _escape(key)))
+    for (key, value) in new.items():
+        child = path + '/' + _escape(key)
+        if key not in old:
+            ops.append(dict(op='add', path=child, value=value))
+        else:
+            ops.extend(make_patch(old[key], value, child))
+    return ops
+
+
+def apply_patch(doc, ops):
+    """Apply JSON patch operations to a document in place.
+
+    Operations whose parent is missing are skipped, so that a log can be
+    replayed over a snapshot that already includes some of it.
+
+    Returns
+    -------
+    The patched document, which is a new object if the root was replaced.
+    """
+    for op in ops:
+        value = copy.deepcopy(op.get('value'))
+        if not op['path']:
+            if op['op'] in ('add', 'replace'):
+                doc = value
+            continue
+        tokens = [_unescape(t) for t in op['path'].split('/')[1:]]
+        parent = doc
+        for token in tokens[:-1]:
+            if isinstance(parent, list) and token.isdigit():
+                token = int(token)
+                parent = parent[token] if token < len(parent) else None
+            elif isinstance(parent, dict):
+                parent = parent.get(token)
+            else:
+                parent = None
+            if parent is None:
+                break
+        if not isinstance(parent, (dict, list)):
+            continue
+        key = tokens[-1]
+        if isinstance(parent, list):
+            if key == '-':
+                key = len(parent)
+            elif not key.isdigit():
+                continue
+            key = int(key)
+            if op['op'] == 'add' and key <= len(parent):
+                parent.insert(key, value)
+            elif op['op'] == 'replace' and key < len(parent):
+                parent[key] = value
+            elif op['op'] == 'remove' and key < len(parent):
+                del parent[key]
+        elif op['op'] in ('add', 'replace'):
+            parent[key] = value
+        elif op['op'] == 'remove':
+            parent.pop(key, None)
+    return doc
+
+
+def _fsync_dir(path):
+    """Flush a directory entry, so a rename in it is durable."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _tmp_path(path):
+    """Get a temporary path next to a file, unique to the process and the
+    thread, so concurrent writers of the same file do not share it."""
+    return '%s.%i.%i.tmp' % (path, os.getpid(), threading.get_ident())
+
+
+def _write_atomic(path, data):
+    """Durably replace a file with new contents."""
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'w', encoding='utf-8') as fid:
+        fid.write(data)
+        fid.flush()
+        os.fsync(fid.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+class WorkspaceStore(object):
+    """An append-only, compacting store of workspaces in a directory.
+
+    Parameters
+    ----------
+    directory: str
+        The workspaces directory.
+    compact_entries: int, optional
+        The number of logged patches after which the log is compacted.
+    log: logging.Logger, optional
+        The logger to use.
+    """
+
+    def __init__(self, directory, compact_entries=100, log=None):
+        self.directory = directory
+        self.compact_entries = compact_entries
+        self.log = log or logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        # Slug -> dict(workspace, entries, signature, created, last_modified).
+        self._cache = {}
+        self._compacting = set()
+
+    def _paths(self, slug):
+        path = os.path.join(self.directory, slug + WORKSPACE_EXTENSION)
+        return path, path + LOG_EXTENSION
+
+    def _signature(self, slug):
+        snapshot_path, log_path = self._paths(slug)
+        return [stat_signature(snapshot_path), stat_signature(log_path)]
+
+    def _load(self, slug):
+        """Get the materialized state of a workspace, or None if it does not
+        exist, reading it from disk if it changed."""
+        sig = self._signature(slug)
+        cached = self._cache.get(slug)
+        if cached is not None and cached['signature'] == sig:
+            return cached
+        if sig[0] is None:
+            self._cache.pop(slug, None)
+            return None
+
+        snapshot_path, log_path = self._paths(slug)
+        with open(snapshot_path, encoding='utf-8') as fid:
+            workspace = json.load(fid)
+        entries = 0
+        if sig[1] is not None:
+            offset = 0
+            with open(log_path, 'rb') as fid:
+                for line in fid:
+                    try:
+                        ops = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        ops = None
+                    if ops is None or not line.endswith(b'\n'):
+                        # A write that was cut short, which is dropped so
+                        # that later entries are appended after valid ones.
+                        self.log.warning('Dropping a truncated entry in %s',
+                                         log_path)
+                        os.truncate(log_path, offset)
+                        sig = self._signature(slug)
+                        break
+                    workspace = apply_patch(workspace, ops)
+                    offset += len(line)
+                    entries += 1
+        st = os.stat(snapshot_path)
+        state = dict(
+            workspace=workspace,
+            entries=entries,
+            signature=sig,
+            created=tz.utcfromtimestamp(st.st_ctime).isoformat(),
+            last_modified=tz.utcfromtimestamp(
+                max(st.st_mtime, os.stat(log_path).st_mtime if sig[1]
+                    else 0)).isoformat()
+        )
+        self._cache[slug] = state
+        return state
+
+    def _with_times(self, state):
+        # Only the metadata is copied, the rest is shared with the cache.
+        workspace = dict(state['workspace'])
+        workspace['metadata'] = dict(
+            workspace.get('metadata', {}),
+            last_modified=state['last_modified'],
+            created=state['created']
+        )
+        return workspace
+
+    def get(self, slug):
+        """Get a workspace with its file times, or None if it does not
+        exist.  The workspace must not be modified."""
+        with self._lock:
+            state = self._load(slug)
+            return None if state is None else self._with_times(state)
+
+    def list(self, prefix=''):
+        """List the workspaces whose slug starts with a prefix.
+
+        Returns
+        -------
+        A dict with the `ids` and `values` of the workspaces.
+        """
+        workspaces = dict(ids=[], values=[])
+        if not os.path.exists(self.directory):
+            return workspaces
+        slugs = sorted(
+            name[:-len(WORKSPACE_EXTENSION)]
+            for name in os.listdir(self.directory)
+            if name.startswith(prefix) and name.endswith(WORKSPACE_EXTENSION)
+        )
+        for slug in slugs:
+            workspace = self.get(slug)
+            if workspace is not None:
+                workspaces['ids'].append(workspace['metadata']['id'])
+                workspaces['values'].append(workspace)
+        return workspaces
+
+    def save(self, slug, workspace):
+        """Save a workspace, appending the patch from its previous state to
+        the log."""
+        snapshot_path, log_path = self._paths(slug)
+        with self._lock:
+            state = self._load(slug)
+            if state is None:
+                os.makedirs(self.directory, exist_ok=True)
+                _write_atomic(snapshot_path, json.dumps(workspace))
+                self._cache.pop(slug, None)
+                return
+
+            ops = make_patch(state['workspace'], workspace)
+            if not ops:
+                return
+            with open(log_path, 'a', encoding='utf-8') as fid:
+                fid.write(json.dumps(ops) + '\n')
+                fid.flush()
+                os.fsync(fid.fileno())
+                mtime = os.fstat(fid.fileno()).st_mtime
+            state.update(
+                workspace=copy.deepcopy(workspace),
+                entries=state['entries'] + 1,
+                signature=self._signature(slug),
+                last_modified=tz.utcfromtimestamp(mtime).isoformat()
+            )
+            if state['entries'] >= self.compact_entries:
+                self._schedule_compaction(slug)
+
+    def delete(self, slug):
+        """Delete a workspace.
+
+        Returns
+        -------
+        False if the workspace does not exist, True otherwise.
+        """
+        snapshot_path, log_path = self._paths(slug)
+        with self._lock:
+            self._cache.pop(slug, None)
+            if not os.path.exists(snapshot_path):
+                return False
+            os.remove(snapshot_path)
+            if os.path.exists(log_path):
+                os.remove(log_path)
+            return True
+
+    def _schedule_compaction(self, slug):
+        if slug in self._compacting:
+            return
+        self._compacting.add(slug)
+        try:
+            loop = IOLoop.current()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            self._compact_task(slug)
+            return
+        loop.run_in_executor(None, self._compact_task, slug)
+
+    def _compact_task(self, slug):
+        try:
+            self.compact(slug)
+        except Exception:
+            self.log.exception('Failed to compact workspace %s', slug)
+        finally:
+            with self._lock:
+                self._compacting.discard(slug)
+
+    def compact_all(self):
+        """Compact the logs of all the workspaces, so that the snapshots are
+        complete for readers that ignore the logs, such as the default
+        workspaces handlers.  The log of a missing snapshot is removed.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        suffix = WORKSPACE_EXTENSION + LOG_EXTENSION
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(suffix):
+                continue
+            slug = name[:-len(suffix)]
+            snapshot_path, log_path = self._paths(slug)
+            if os.path.exists(snapshot_path):
+                self.compact(slug)
+            else:
+                os.remove(log_path)
+
+    def compact(self, slug):
+        """Write the current state of a workspace as its snapshot and clear
+        its log.
+
+        The snapshot is written outside of the lock, and the patches saved
+        in the meantime are kept in the log.
+        """
+        snapshot_path, log_path = self._paths(slug)
+        with self._lock:
+            state = self._load(slug)
+            if state is None or not state['entries']:
+                return
+            data = json.dumps(state['workspace'])
+            offset = os.path.getsize(log_path)
+
+        tmp_path = _tmp_path(snapshot_path)
+        with open(tmp_path, 'w', encoding='utf-8') as fid:
+            fid.write(data)
+            fid.flush()
+            os.fsync(fid.fileno())
+
+        with self._lock:
+            with open(log_path, 'rb') as fid:
+                fid.seek(offset)
+                rest = fid.read()
+            # Patches replayed over a snapshot that includes them are
+            # harmless, so a crash between these two steps is safe.
+            os.replace(tmp_path, snapshot_path)
+            if rest:
+                tmp_log_path = _tmp_path(log_path)
+                with open(tmp_log_path, 'wb') as fid:
+                    fid.write(rest)
+                    fid.flush()
+                    os.fsync(fid.fileno())
+                os.replace(tmp_log_path, log_path)
+            else:
+                os.remove(log_path)
+            _fsync_dir(self.directory)
+            # The in-memory copy already includes the patches that are left.
+            state = self._cache.get(slug)
+            if state is not None:
+                state.update(entries=rest.count(b'\n'),
+                             signature=self._signature(slug))